@@ -1,6 +1,8 @@
+import numpy as np
 import socket
 import struct
 import sys
+import time
 
 class ArtNet():
     def __init__(self, ip='192.168.1.255', port=6454):
@@ -11,27 +13,43 @@ class ArtNet():
         self.ip = ip
         # UDP ArtNet Port
         self.port = port
-
-    def broadcastDMX(self, dmxdata, address):
-        content = []
+        # preallocate the packet, the fixed part of the header only needs to be written once
+        self.packet = bytearray(18 + 512)
         # Name, 7byte + 0x00
-        content.append(b'Art-Net\x00')
+        self.packet[0:8] = b'Art-Net\x00'
         # OpCode ArtDMX -> 0x5000, Low Byte first
-        content.append(struct.pack('<H', 0x5000))
+        struct.pack_into('<H', self.packet, 8, 0x5000)
         # Protocol Version 14, High Byte first
-        content.append(struct.pack('>H', 14))
+        struct.pack_into('>H', self.packet, 10, 14)
         # Order -> nope -> 0x00
-        content.append(b'\x00')
+        self.packet[12] = 0x00
         # Eternity Port
-        content.append(b'\x01')
+        self.packet[13] = 0x01
+
+    def broadcastDMX(self, dmxdata, address):
+        # the packet consists of an 18 byte header, followed by up to 512 bytes of DMX data
+        content = self.packet
         # Address
         net, subnet, universe = address
-        content.append(struct.pack('<H', net << 8 | subnet << 4 | universe))
+        struct.pack_into('<H', content, 14, net << 8 | subnet << 4 | universe)
         # Length of DMX Data, High Byte First
-        content.append(struct.pack('>H', len(dmxdata)))
-        # append the actual DMX Data
-        for d in dmxdata:
-            content.append(struct.pack('B', d))
+        struct.pack_into('>H', content, 16, len(dmxdata))
+        # copy the actual DMX Data, this should be a list of integers or an array of bytes
+        content[18:18 + len(dmxdata)] = bytes(dmxdata)
+        # send
+        self.s.sendto(memoryview(content)[:18 + len(dmxdata)], (self.ip, self.port))
+
+    def broadcastSync(self):
+        # the ArtSync packet tells the nodes to output the DMX data that they have received
+        content = []
+        # Name, 7byte + 0x00
+        content.append(b'Art-Net\x00')
+        # OpCode ArtSync -> 0x5200, Low Byte first
+        content.append(struct.pack('<H', 0x5200))
+        # Protocol Version 14, High Byte first
+        content.append(struct.pack('>H', 14))
+        # Aux1 and Aux2 -> 0x00
+        content.append(b'\x00\x00')
         # stitch it together
         content = b''.join(content)
         # send
@@ -40,6 +58,42 @@ class ArtNet():
     def close(self):
         self.s.close()
 
+
+class ArtNetSender(ArtNet):
+    """Keep a frame for each of multiple universes and send the ones that changed.
+
+    The frames can be updated in place, e.g. sender.frame[0, 0:3] = [255, 0, 0]
+    and are subsequently sent with sender.send(). Universes that did not change
+    are refreshed after the keepalive time. Once one or more universes have been
+    sent, an ArtSync packet is sent so that all nodes update at the same time.
+    """
+
+    def __init__(self, addresses, ip='192.168.1.255', port=6454, size=512, keepalive=0.5, sync=True):
+        ArtNet.__init__(self, ip=ip, port=port)
+        self.addresses = [list(address) for address in addresses]
+        self.keepalive = keepalive
+        self.sync = sync
+        # the frame that is to be sent and the frame that was previously sent
+        self.frame = np.zeros((len(self.addresses), size), dtype=np.uint8)
+        self.previous = self.frame.copy()
+        self.prevtime = np.zeros(len(self.addresses))
+
+    def send(self, force=False):
+        now = time.time()
+        changed = np.any(self.frame != self.previous, axis=1)
+        # refresh the universes that have not been sent for some time
+        changed |= (now - self.prevtime) > self.keepalive
+        if force:
+            changed[:] = True
+        for i in np.flatnonzero(changed):
+            self.broadcastDMX(self.frame[i], self.addresses[i])
+            self.previous[i] = self.frame[i]
+            self.prevtime[i] = now
+        if self.sync and np.any(changed):
+            self.broadcastSync()
+        # return the number of universes that were sent
+        return int(np.sum(changed))
+
 if __name__ == '__main__':
 	import time
 	artnet = ArtNet()
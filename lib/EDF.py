@@ -1,6 +1,4 @@
-from copy import deepcopy
 from math import ceil, floor
-from struct import pack, unpack
 import calendar
 import datetime
 import numpy as np
@@ -33,34 +31,21 @@ class EDFWriter():
         self.calibrate = None
         self.offset    = None
         self.n_records = 0
+        self.fid = None
         if fname:
             self.open(fname)
 
     def open(self, fname):
-        with open(fname, 'wb') as fid:
-            assert(fid.tell() == 0)
+        # the file remains open while writing, the blocks are appended to it
+        self.fid = open(fname, 'wb')
+        assert(self.fid.tell() == 0)
         self.fname = fname
 
     def close(self):
         # it is still needed to update the number of records in the header
-        # this requires copying the whole file content
-        meas_info = self.meas_info
-        chan_info = self.chan_info
-        # update the n_records value in the file
-        tempname = self.fname + '.bak'
-        os.rename(self.fname, tempname)
-        with open(tempname, 'rb') as fid1:
-            assert(fid1.tell() == 0)
-            with open(self.fname, 'wb') as fid2:
-                assert(fid2.tell() == 0)
-                fid2.write(fid1.read(236))
-                fid1.read(8)                                    # skip this part
-                fid2.write(padtrim(str(self.n_records), 8))     # but write this instead
-                fid2.write(fid1.read(meas_info['data_offset'] - 236 - 8))
-                blocksize = np.sum(chan_info['n_samps']) * meas_info['data_size']
-                for block in range(self.n_records):
-                    fid2.write(fid1.read(blocksize))
-        os.remove(tempname)
+        self.updateHeader()
+        self.fid.close()
+        self.fid = None
         self.fname = None
         self.meas_info = None
         self.chan_info = None
@@ -69,6 +54,13 @@ class EDFWriter():
         self.n_records = 0
         return
 
+    def updateHeader(self):
+        # write the n_records value on byte 236 in the file, and continue writing at the end
+        self.fid.seek(236)
+        self.fid.write(padtrim(str(self.n_records), 8))
+        self.fid.seek(0, os.SEEK_END)
+        self.fid.flush()
+
     def writeHeader(self, header):
         meas_info = header[0]
         chan_info = header[1]
@@ -76,65 +68,65 @@ class EDFWriter():
         chan_size = 256 * meas_info['nchan']
         # note that the file is opened in binary mode, but the initial header is largely text
         # the padtrim function also converts the text to bytes
-        with open(self.fname, 'wb') as fid:
-            assert(fid.tell() == 0)
-
-            # fill in the missing or incomplete information
-            if not 'subject_id' in meas_info:
-                meas_info['subject_id'] = ''
-            if not 'recording_id' in meas_info:
-                meas_info['recording_id'] = ''
-            if not 'subtype' in meas_info:
-                meas_info['subtype'] = 'edf'
-            nchan = meas_info['nchan']
-            if not 'ch_names' in chan_info or len(chan_info['ch_names'])<nchan:
-                chan_info['ch_names'] = [str(i) for i in range(nchan)]
-            if not 'transducers' in chan_info or len(chan_info['transducers'])<nchan:
-                chan_info['transducers'] = ['' for i in range(nchan)]
-            if not 'units' in chan_info or len(chan_info['units'])<nchan:
-                chan_info['units'] = ['' for i in range(nchan)]
-
-            if meas_info['subtype'] in ('24BIT', 'bdf'):
-                meas_info['data_size'] = 3  # 24-bit (3 byte) integers
-            else:
-                meas_info['data_size'] = 2  # 16-bit (2 byte) integers
-
-            fid.write(padtrim('0', 8))
-            fid.write(padtrim(meas_info['subject_id'], 80))
-            fid.write(padtrim(meas_info['recording_id'], 80))
-            fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['day'], meas_info['month'], meas_info['year']), 8))
-            fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['hour'], meas_info['minute'], meas_info['second']), 8))
-            fid.write(padtrim(str(meas_size + chan_size), 8))
-            fid.write(' '.encode() * 44)
-            fid.write(padtrim(str(-1), 8))  # the final n_records should be inserted on byte 236
-            fid.write(padtrim(str(meas_info['record_length']), 8))
-            fid.write(padtrim(str(meas_info['nchan']), 4))
-
-            # ensure that these are all np arrays rather than lists
-            for key in ['physical_min', 'transducers', 'physical_max', 'digital_max', 'ch_names', 'n_samps', 'units', 'digital_min']:
-                chan_info[key] = np.asarray(chan_info[key])
-
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['ch_names'][i], 16))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['transducers'][i], 80))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(    chan_info['units'][i], 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['physical_min'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['physical_max'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['digital_min'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['digital_max'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(' '.encode() * 80) # prefiltering
-            for i in range(meas_info['nchan']):
-                fid.write(padtrim(str(chan_info['n_samps'][i]), 8))
-            for i in range(meas_info['nchan']):
-                fid.write(' '.encode() * 32) # reserved
-            meas_info['data_offset'] = fid.tell()
+        fid = self.fid
+        fid.seek(0)
+
+        # fill in the missing or incomplete information
+        if not 'subject_id' in meas_info:
+            meas_info['subject_id'] = ''
+        if not 'recording_id' in meas_info:
+            meas_info['recording_id'] = ''
+        if not 'subtype' in meas_info:
+            meas_info['subtype'] = 'edf'
+        nchan = meas_info['nchan']
+        if not 'ch_names' in chan_info or len(chan_info['ch_names'])<nchan:
+            chan_info['ch_names'] = [str(i) for i in range(nchan)]
+        if not 'transducers' in chan_info or len(chan_info['transducers'])<nchan:
+            chan_info['transducers'] = ['' for i in range(nchan)]
+        if not 'units' in chan_info or len(chan_info['units'])<nchan:
+            chan_info['units'] = ['' for i in range(nchan)]
+
+        if meas_info['subtype'] in ('24BIT', 'bdf'):
+            meas_info['data_size'] = 3  # 24-bit (3 byte) integers
+        else:
+            meas_info['data_size'] = 2  # 16-bit (2 byte) integers
+
+        fid.write(padtrim('0', 8))
+        fid.write(padtrim(meas_info['subject_id'], 80))
+        fid.write(padtrim(meas_info['recording_id'], 80))
+        fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['day'], meas_info['month'], meas_info['year']), 8))
+        fid.write(padtrim('{:0>2d}.{:0>2d}.{:0>2d}'.format(meas_info['hour'], meas_info['minute'], meas_info['second']), 8))
+        fid.write(padtrim(str(meas_size + chan_size), 8))
+        fid.write(' '.encode() * 44)
+        fid.write(padtrim(str(-1), 8))  # the final n_records should be inserted on byte 236
+        fid.write(padtrim(str(meas_info['record_length']), 8))
+        fid.write(padtrim(str(meas_info['nchan']), 4))
+
+        # ensure that these are all np arrays rather than lists
+        for key in ['physical_min', 'transducers', 'physical_max', 'digital_max', 'ch_names', 'n_samps', 'units', 'digital_min']:
+            chan_info[key] = np.asarray(chan_info[key])
+
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['ch_names'][i], 16))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['transducers'][i], 80))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(    chan_info['units'][i], 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['physical_min'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['physical_max'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['digital_min'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['digital_max'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(' '.encode() * 80) # prefiltering
+        for i in range(meas_info['nchan']):
+            fid.write(padtrim(str(chan_info['n_samps'][i]), 8))
+        for i in range(meas_info['nchan']):
+            fid.write(' '.encode() * 32) # reserved
+        meas_info['data_offset'] = fid.tell()
 
         self.meas_info = meas_info
         self.chan_info = chan_info
@@ -149,26 +141,30 @@ class EDFWriter():
     def writeBlock(self, data):
         meas_info = self.meas_info
         chan_info = self.chan_info
-        with open(self.fname, 'ab') as fid:
-            assert(fid.tell() > 0)
-            for i in range(meas_info['nchan']):
-                raw = deepcopy(data[i])
-                raw = np.asarray(raw, dtype=np.float64)
-
-                assert(len(raw)==chan_info['n_samps'][i])
-                if min(raw)<chan_info['physical_min'][i]:
-                    warnings.warn('Value exceeds physical_min: ' + str(min(raw)) );
-                if max(raw)>chan_info['physical_max'][i]:
-                    warnings.warn('Value exceeds physical_max: '+ str(max(raw)));
-
-                raw -= self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
-                raw /= self.calibrate[i]
-
-                raw = np.asarray(raw, dtype=np.int16)
-                buf = [pack('h', x) for x in raw]
-                for val in buf:
-                    fid.write(val)
-            self.n_records += 1
+        assert(self.fid.tell() > 0)
+        n_samps = chan_info['n_samps']
+        # concatenate all channels, this also works if they have a different number of samples
+        raw = np.concatenate([np.asarray(dat, dtype=np.float64).reshape(-1) for dat in data])
+        assert(len(data)==meas_info['nchan'])
+        assert(len(raw)==np.sum(n_samps))
+
+        # the first sample of each channel
+        first = np.cumsum(n_samps) - n_samps
+        if np.any(np.minimum.reduceat(raw, first)<chan_info['physical_min']):
+            warnings.warn('Value exceeds physical_min: ' + str(np.min(raw)) );
+        if np.any(np.maximum.reduceat(raw, first)>chan_info['physical_max']):
+            warnings.warn('Value exceeds physical_max: '+ str(np.max(raw)));
+
+        raw -= np.repeat(self.offset, n_samps)  # FIXME I am not sure about the order of calibrate and offset
+        raw /= np.repeat(self.calibrate, n_samps)
+
+        if meas_info['data_size'] == 3:
+            # keep the three least significant bytes of each little-endian 32-bit integer
+            raw = np.asarray(raw, dtype='<i4').view(np.uint8).reshape(-1, 4)[:, 0:3]
+        else:
+            raw = np.asarray(raw, dtype='<i2')
+        self.fid.write(raw.tobytes())
+        self.n_records += 1
 
 ####################################################################################################
 
@@ -179,6 +175,7 @@ class EDFReader():
         self.chan_info = None
         self.calibrate = None
         self.offset    = None
+        self.records   = None
         if fname:
             self.open(fname)
 
@@ -187,6 +184,7 @@ class EDFReader():
             assert(fid.tell() == 0)
         self.fname = fname
         self.readHeader()
+        self.mapRecords()
         return self.meas_info, self.chan_info
 
     def close(self):
@@ -195,6 +193,7 @@ class EDFReader():
         self.chan_info = None
         self.calibrate = None
         self.offset    = None
+        self.records   = None
 
     def readHeader(self):
         # the following is copied over from MNE-Python and subsequently modified
@@ -304,35 +303,64 @@ class EDFReader():
         self.chan_info = chan_info
         return (meas_info, chan_info)
 
-    def readBlock(self, block):
-        assert(block>=0)
+    def mapRecords(self):
+        # map the data records in the file onto a structured array, with one field per channel
+        # the data is only read from disk when the corresponding records are accessed
         meas_info = self.meas_info
         chan_info = self.chan_info
+        if meas_info['data_size'] == 3:
+            formats = [('u1', (int(n), 3)) for n in chan_info['n_samps']]
+        else:
+            formats = [('<i2', (int(n),)) for n in chan_info['n_samps']]
+        names = ['ch%d' % i for i in range(meas_info['nchan'])]
+        dtype = np.dtype({'names': names, 'formats': formats})
+        if meas_info['n_records'] > 0:
+            self.records = np.memmap(self.fname, dtype=dtype, mode='r', offset=meas_info['data_offset'], shape=(meas_info['n_records'],))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+        return self.records
+
+    def readDigital(self, channel, begblock, endblock):
+        # return the uncalibrated values of one channel as a flat array
+        raw = self.records['ch%d' % channel][begblock:(endblock+1)]
+        if self.meas_info['data_size'] == 3:
+            # combine the three little-endian bytes into a signed 24-bit integer
+            raw = raw.astype(np.int32)
+            raw = raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16)
+            raw[raw >= 0x800000] -= 0x1000000
+        return raw.reshape(-1)
+
+    def readBlock(self, block):
+        assert(block>=0)
         data = []
-        with open(self.fname, 'rb') as fid:
-            assert(fid.tell() == 0)
-            blocksize = np.sum(chan_info['n_samps']) * meas_info['data_size']
-            fid.seek(meas_info['data_offset'] + block * blocksize)
-            for i in range(meas_info['nchan']):
-                buf = fid.read(chan_info['n_samps'][i]*meas_info['data_size'])
-                raw = np.asarray(unpack('<{}h'.format(chan_info['n_samps'][i]), buf), dtype=np.float32)
-                raw *= self.calibrate[i]
-                raw += self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
-                data.append(raw)
+        for i in range(self.meas_info['nchan']):
+            raw = self.readDigital(i, block, block).astype(np.float32)
+            raw *= self.calibrate[i]
+            raw += self.offset[i]  # FIXME I am not sure about the order of calibrate and offset
+            data.append(raw)
         return data
 
     def readSamples(self, channel, begsample, endsample):
-        meas_info = self.meas_info
+        # a single channel returns a vector, a list of channels returns a samples x channels matrix
         chan_info = self.chan_info
-        n_samps = chan_info['n_samps'][channel]
+        channels = np.atleast_1d(channel).astype(int)
+        n_samps = chan_info['n_samps'][channels]
+        if np.any(n_samps != n_samps[0]):
+            raise ValueError('the channels have a different number of samples per record')
+        n_samps = n_samps[0]
         begblock = int(floor((begsample) / n_samps))
         endblock = int(floor((endsample) / n_samps))
-        data = self.readBlock(begblock)[channel]
-        for block in range(begblock+1, endblock+1):
-            data = np.append(data, self.readBlock(block)[channel])
         begsample -= begblock*n_samps
         endsample -= begblock*n_samps
-        return data[begsample:(endsample+1)]
+        raw = np.empty((endsample-begsample+1, len(channels)), dtype=np.int32)
+        for i, ch in enumerate(channels):
+            dat = self.readDigital(ch, begblock, endblock)[begsample:(endsample+1)]
+            raw[:, i] = dat
+        data = (raw * self.calibrate[channels] + self.offset[channels]).astype(np.float32)
+        if np.ndim(channel) == 0:
+            return data[:, 0]
+        else:
+            return data
 
 ####################################################################################################
 # the following are a number of helper functions to make the behaviour of this EDFReader
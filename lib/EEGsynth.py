@@ -3,7 +3,9 @@ from __future__ import print_function
 import sys
 import time
 import threading
+import traceback
 import math
+import redis
 import numpy as np
 from scipy.signal import firwin, butter, bessel, lfilter, lfiltic, iirnotch
 import logging
@@ -230,6 +232,199 @@ Press Ctrl-C to stop this module.
         else:
             self.logger.log(logging.TRACE, " ".join(map(format, args)))
 
+###################################################################################################
+class dispatcher(threading.Thread):
+    """Class to dispatch messages that are published in Redis to callback functions. It uses a
+    single pubsub connection and a single thread for all channels, and reconnects to Redis when
+    the connection is lost.
+
+    dispatcher(r)                           - to be created with the Redis connection
+    dispatcher.register(channel, callback)  - callback(item) is called for each message on the channel
+    dispatcher.start()                      - start listening in the background
+    dispatcher.stop()                       - stop listening and wait for the thread to finish
+    """
+
+    def __init__(self, r, timeout=0.1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.redis = r
+        self.timeout = timeout
+        self.callbacks = {}
+        self.lock = threading.Lock()
+        self.running = True
+
+    def register(self, channel, callback):
+        with self.lock:
+            self.callbacks.setdefault(channel, []).append(callback)
+
+    def stop(self):
+        self.running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        pubsub = None
+        subscribed = set()
+        while self.running:
+            try:
+                if pubsub is None:
+                    pubsub = self.redis.pubsub()
+                    subscribed = set()
+                # channels can also be registered after the thread has started
+                with self.lock:
+                    channels = [channel for channel in self.callbacks if channel not in subscribed]
+                if len(channels):
+                    pubsub.subscribe(*channels)
+                    subscribed.update(channels)
+                if len(subscribed)==0:
+                    time.sleep(self.timeout)
+                    continue
+                item = pubsub.get_message(timeout=self.timeout)
+            except (redis.ConnectionError, redis.TimeoutError):
+                # reconnect and subscribe again to all channels
+                pubsub = None
+                time.sleep(self.timeout)
+                continue
+
+            if item is None or item['type'] != 'message':
+                continue
+
+            with self.lock:
+                callbacks = list(self.callbacks.get(item['channel'], []))
+            for callback in callbacks:
+                try:
+                    callback(item)
+                except:
+                    # an error in one of the callbacks should not stop the others
+                    traceback.print_exc()
+
+        if pubsub is not None:
+            pubsub.close()
+
+
+###################################################################################################
+class ingest(threading.Thread):
+    """Class to write incoming values to Redis in batches. The values are collected during a short
+    window, after which only the latest value of each key is set and published, using a single
+    pipeline. This allows keeping up with bursts of incoming messages at the expense of a small
+    latency.
+
+    ingest(patch, window, maxsize, monitor) - to be created with the patch and the window in seconds
+    ingest.put(key, val)                    - queue a value, returns False if it was dropped
+    ingest.depth()                          - the number of keys that are waiting to be written
+    ingest.start()                          - start writing in the background
+    ingest.stop()                           - write the remaining values and wait for the thread to finish
+
+    The received, written, coalesced and dropped attributes count the values. The values of a batch
+    that cannot be written are dropped and reported to the optional monitor.
+    """
+
+    def __init__(self, patch, window=0.01, maxsize=10000, monitor=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.patch = patch
+        self.monitor = monitor
+        self.window = window
+        self.maxsize = maxsize
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.running = True
+        self.received = 0
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def put(self, key, val):
+        with self.condition:
+            self.received += 1
+            if key in self.pending:
+                # the previous value has not been written yet and is replaced
+                self.coalesced += 1
+            elif len(self.pending) >= self.maxsize:
+                self.dropped += 1
+                return False
+            self.pending[key] = val
+            self.condition.notify()
+        return True
+
+    def depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    def flush(self):
+        with self.condition:
+            items = self.pending
+            self.pending = {}
+        if len(items):
+            try:
+                self.patch.setvalues(items)
+                self.written += len(items)
+            except redis.RedisError as e:
+                # a failed batch should not stop the thread that writes the subsequent ones
+                self.dropped += len(items)
+                if self.monitor is not None:
+                    self.monitor.error('Failed to write %d values to Redis: %s' % (len(items), e))
+        return len(items)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.flush()
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and len(self.pending)==0:
+                    self.condition.wait()
+            # collect the values that arrive within the window
+            time.sleep(self.window)
+            self.flush()
+
+
+###################################################################################################
+class pacer():
+    """Class to keep a loop that sends blocks of samples in pace with the wall clock. The moment
+    at which each block is due follows from the start time and the duration of all blocks that
+    have been sent, so that the jitter in processing and sleeping does not accumulate.
+
+    pacer(fsample)                  - to be created with the nominal sampling rate
+    pacer.update(nsamples, speed)   - to be called after each block has been sent
+    pacer.wait()                    - sleep until the next block is due, returns the lag
+    pacer.lag()                     - seconds behind (positive) or ahead (negative) of schedule
+    pacer.reset()                   - start a new schedule, e.g. after pausing
+    """
+
+    def __init__(self, fsample, maxlag=None):
+        self.fsample = float(fsample)
+        # when the lag exceeds this, the schedule starts anew rather than catching up
+        self.maxlag = maxlag
+        self.reset()
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.duration = 0.
+        self.nsamples = 0
+
+    def update(self, nsamples, speed=1.):
+        # the duration of each block depends on the speed at the moment it was sent
+        self.duration += nsamples / (self.fsample * speed)
+        self.nsamples += nsamples
+
+    def lag(self):
+        return time.monotonic() - (self.start + self.duration)
+
+    def wait(self):
+        lag = self.lag()
+        if lag < 0:
+            time.sleep(-lag)
+        elif self.maxlag != None and lag > self.maxlag:
+            self.reset()
+        return lag
+
+
 ###################################################################################################
 class patch():
     """Class to provide a generalized interface for patching modules using
@@ -250,53 +445,103 @@ class patch():
     def __init__(self, c, r):
         self.config = c
         self.redis  = r
+        self.parsed = {}    # the ini file items that have been split into a list
+        self.cached = {}    # the values that have been retrieved from Redis, with the time
+        # values retrieved from Redis can be reused for a short time, by default they are not
+        try:
+            self.ttl = float(self.config.get('redis', 'ttl'))
+        except:
+            self.ttl = 0
 
     ####################################################################
-    def getfloat(self, section, item, multiple=False, default=None):
-        if self.config.has_option(section, item) and len(self.config.get(section, item))>0:
-            # get all items from the ini file, there might be one or multiple
-            items = self.config.get(section, item)
+    def _split(self, items, multiple):
+        # convert the items from the ini file into a list, the result is cached
+        try:
+            return self.parsed[(items, multiple)]
+        except KeyError:
+            pass
 
-            if multiple:
-                # convert the items to a list
-                if items.find(",") > -1:
-                    separator = ","
-                elif items.find("-") > -1:
-                    separator = "-"
-                elif items.find("\t") > -1:
-                    separator = "\t"
-                else:
-                    separator = " "
-                items = squeeze(' ', items)        # remove excess whitespace
-                items = squeeze(separator, items)  # remove double separators
-                items = items.split(separator)     # split on the separator
+        if multiple:
+            # convert the items to a list
+            if items.find(",") > -1:
+                separator = ","
+            elif items.find("-") > -1:
+                separator = "-"
+            elif items.find("\t") > -1:
+                separator = "\t"
             else:
-                # make a list with a single item
-                items = [items]
+                separator = " "
+            val = squeeze(' ', items)          # remove excess whitespace
+            val = squeeze(separator, val)      # remove double separators
+            val = val.split(separator)         # split on the separator
+        else:
+            # make a list with a single item
+            val = [items]
 
-            # set the default
-            if default != None:
-                val = [float(default)] * len(items)
-            else:
-                val = [default] * len(items)
+        self.parsed[(items, multiple)] = val
+        return val
 
-            # convert the strings into floating point values
-            for i,item in enumerate(items):
-                try:
-                    # if it resembles a value, use that
-                    val[i] = float(item)
-                except ValueError:
-                    # if it is a string, get the value from Redis
-                    try:
-                        val[i] = float(self.redis.get(item))
-                    except TypeError:
-                        pass
+    ####################################################################
+    def _getredis(self, keys):
+        # get the values of one or multiple keys from Redis in a single round trip
+        if self.ttl > 0:
+            now = time.time()
+            stale = [key for key in keys if key not in self.cached or (now - self.cached[key][0]) > self.ttl]
+        else:
+            stale = keys
+
+        val = []
+        if len(stale) == 1:
+            val = [self.redis.get(stale[0])]
+        elif len(stale) > 1:
+            val = self.redis.mget(stale)
+
+        if self.ttl == 0:
+            return val
+
+        for key, v in zip(stale, val):
+            self.cached[key] = (now, v)
+        return [self.cached[key][1] for key in keys]
+
+    ####################################################################
+    def _getvalues(self, section, item, multiple, convert):
+        # get the items from the ini file, and the values of the items that are not numbers from Redis
+        items = self._split(self.config.get(section, item), multiple)
+        val = [None] * len(items)
+        keys = []
+        for i, item in enumerate(items):
+            try:
+                # if it resembles a value, use that
+                val[i] = convert(item)
+            except ValueError:
+                # if it is a string, get the value from Redis
+                keys.append(i)
+
+        if len(keys):
+            for i, v in zip(keys, self._getredis([items[i] for i in keys])):
+                if v is not None:
+                    val[i] = float(v)
+        return val
+
+    ####################################################################
+    def getfloat(self, section, item, multiple=False, default=None):
+        if self.config.has_option(section, item) and len(self.config.get(section, item))>0:
+            # get all items from the ini file, there might be one or multiple
+            val = self._getvalues(section, item, multiple, float)
+
+            # use the default for the items that could not be converted, this can be a single value or a list
+            for i, v in enumerate(val):
+                if v is None and default != None:
+                    if isinstance(default, list):
+                        val[i] = float(default[min(i, len(default) - 1)])
+                    else:
+                        val[i] = float(default)
         else:
             # the configuration file does not contain the item
             if multiple == True and default == None:
                 val = []
             elif multiple == True and default != None:
-                val = [float(x) for x in default]
+                val = [float(x) for x in default] if isinstance(default, list) else [float(default)]
             elif multiple == False and default == None:
                 val = None
             elif multiple == False and default != None:
@@ -316,48 +561,23 @@ class patch():
     def getint(self, section, item, multiple=False, default=None):
         if self.config.has_option(section, item) and len(self.config.get(section, item))>0:
             # get all items from the ini file, there might be one or multiple
-            items = self.config.get(section, item)
-
-            if multiple:
-                # convert the items to a list
-                if items.find(",") > -1:
-                    separator = ","
-                elif items.find("-") > -1:
-                    separator = "-"
-                elif items.find("\t") > -1:
-                    separator = "\t"
-                else:
-                    separator = " "
-                items = squeeze(' ', items)        # remove excess whitespace
-                items = squeeze(separator, items)  # remove double separators
-                items = items.split(separator)     # split on the separator
-            else:
-                # make a list with a single item
-                items = [items]
-
-            # set the default
-            if default != None:
-                val = [int(default)] * len(items)
-            else:
-                val = [default] * len(items)
-
-            # convert the strings into integer values
-            for i,item in enumerate(items):
-                try:
-                    # if it resembles a value, use that
-                    val[i] = int(item)
-                except ValueError:
-                    # if it is a string, get the value from Redis
-                    try:
-                        val[i] = int(round(float(self.redis.get(item))))
-                    except TypeError:
-                        pass
+            val = self._getvalues(section, item, multiple, int)
+
+            # round the values from Redis, and use the default for the items that could not be converted
+            for i, v in enumerate(val):
+                if v is None and default != None:
+                    if isinstance(default, list):
+                        val[i] = int(default[min(i, len(default) - 1)])
+                    else:
+                        val[i] = int(default)
+                elif v is not None:
+                    val[i] = int(round(v))
         else:
             # the configuration file does not contain the item
             if multiple == True and default == None:
                 val = []
             elif multiple == True and default != None:
-                val = [int(x) for x in default]
+                val = [int(x) for x in default] if isinstance(default, list) else [int(default)]
             elif multiple == False and default == None:
                 val = None
             elif multiple == False and default != None:
@@ -373,6 +593,35 @@ class patch():
             else:
                 return val
 
+    ####################################################################
+    def getfloats(self, items, default=None):
+        # get the values for a list of (section, item) tuples, all values from Redis are retrieved in a single round trip
+        try:
+            const, keys = self.parsed[tuple(items)]
+        except KeyError:
+            const = [None] * len(items)
+            keys = []
+            for i, (section, item) in enumerate(items):
+                if self.config.has_option(section, item) and len(self.config.get(section, item))>0:
+                    try:
+                        # if it resembles a value, use that
+                        const[i] = float(self.config.get(section, item))
+                    except ValueError:
+                        # if it is a string, get the value from Redis
+                        keys.append((i, self.config.get(section, item)))
+            self.parsed[tuple(items)] = (const, keys)
+
+        val = list(const)
+        if len(keys):
+            for (i, key), v in zip(keys, self._getredis([key for i, key in keys])):
+                if v is not None:
+                    val[i] = float(v)
+
+        # use the default for the items that could not be found
+        if default != None:
+            val = [float(default) if v is None else v for v in val]
+        return val
+
     ####################################################################
     def getstring(self, section, item, default=None, multiple=False):
         # get all items from the ini file, there might be one or multiple
@@ -416,12 +665,31 @@ class patch():
 
     ####################################################################
     def setvalue(self, item, val, duration=0):
+        self.cached.pop(item, None)
         self.redis.set(item, val)      # set it as control channel
         self.redis.publish(item, val)  # send it as trigger
         if duration > 0:
             # switch off after a certain amount of time
             threading.Timer(duration, self.setvalue, args=[item, 0.]).start()
 
+    ####################################################################
+    def setvalues(self, items, duration=0):
+        # set and publish multiple values in a single round trip to Redis
+        # the items can be specified as a dictionary or as a list with (key, value) tuples
+        if isinstance(items, dict):
+            items = list(items.items())
+        for item, val in items:
+            self.cached.pop(item, None)
+        pipe = self.redis.pipeline(transaction=False)
+        for item, val in items:
+            pipe.set(item, val)      # set it as control channel
+        for item, val in items:
+            pipe.publish(item, val)  # send it as trigger
+        pipe.execute()
+        if duration > 0:
+            # switch off after a certain amount of time
+            threading.Timer(duration, self.setvalues, args=[[(item, 0.) for item, val in items]]).start()
+
 
 ####################################################################
 def rescale(xval, slope=None, offset=None, reverse=False):
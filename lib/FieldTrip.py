@@ -7,9 +7,16 @@ FieldTrip buffer (V1) client in pure Python
 # We need socket, struct, and numpy
 import socket
 import struct
+import time
 import numpy
 import unicodedata
 
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # shared memory requires Python 3.8 or later
+    shared_memory = None
+
 VERSION = 1
 
 PUT_HDR            = 0x0101
@@ -59,6 +66,18 @@ CHUNK_NEUROMAG_FIF       = 8
 CHUNK_NEUROMAG_ISOTRAK   = 9
 CHUNK_NEUROMAG_HPIRESULT = 10
 
+# Layout of the control block at the start of the shared memory ring, as int64 values
+SHM_MAGIC      = 0
+SHM_GENERATION = 1
+SHM_NCHANS     = 2
+SHM_DATATYPE   = 3
+SHM_RINGSIZE   = 4
+SHM_NSAMPLES   = 5
+SHM_NEVENTS    = 6
+SHM_NWRITING   = 7
+SHM_OFFSET     = 64
+SHM_MAGIC_VALUE = 0x46544246
+
 # List for converting FieldTrip datatypes to Numpy datatypes
 numpyType = ['int8', 'uint8', 'uint16', 'uint32', 'uint64',
              'int8', 'int16', 'int32', 'int64', 'float32', 'float64']
@@ -104,6 +123,14 @@ def serialize(A):
     return (DATATYPE_UNKNOWN, None)
 
 
+def sharedName(port):
+    """
+    Returns the name of the shared memory in which the server on the given
+    port keeps its samples.
+    """
+    return 'fieldtrip_%d' % port
+
+
 class Chunk:
 
     def __init__(self):
@@ -174,13 +201,13 @@ class Event:
         raw_value = buf[32 + st:32 + st + sv]
 
         if type_type == 0:
-            self.type = raw_type
+            self.type = bytes(raw_type)
         else:
             self.type = numpy.ndarray(
                 (type_numel), dtype=numpyType[type_type], buffer=raw_type)
 
         if value_type == 0:
-            self.value = raw_value
+            self.value = bytes(raw_value)
         else:
             self.value = numpy.ndarray(
                 (value_numel), dtype=numpyType[value_type], buffer=raw_value)
@@ -219,19 +246,64 @@ class Client:
     def __init__(self):
         self.isConnected = False
         self.sock = []
-
-    def connect(self, hostname, port=1972):
+        self.respHeader = bytearray(8)
+        self.scratchBuffer = bytearray(0)
+        self.shm = None
+        self.ctl = None
+        self.ring = None
+        self.ringGeneration = -1
+
+    def connect(self, hostname, port=1972, shared=False):
         """
-        connect(hostname [, port]) -- make a connection, default port is
-        1972.
+        connect(hostname [, port, shared]) -- make a connection, default port
+        is 1972. If 'shared' is True and the server runs on the same host
+        with its samples in shared memory, getData reads the samples from
+        the shared memory rather than over the connection.
         """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((hostname, port))
         self.sock.setblocking(True)
         self.isConnected = True
+        if shared and hostname in ('localhost', '127.0.0.1'):
+            self.attach(port)
+
+    def attach(self, port):
+        """
+        attach(port) -- map the shared memory of the server on the given
+        port, returns True if successful.
+        """
+        self.detach()
+        if shared_memory is None:
+            return False
+        try:
+            try:
+                self.shm = shared_memory.SharedMemory(name=sharedName(port), track=False)
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=sharedName(port))
+                # the shared memory belongs to the server and should not be removed when this process exits
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except (FileNotFoundError, OSError):
+            self.shm = None
+            return False
+        self.ctl = numpy.ndarray((8,), dtype='int64', buffer=self.shm.buf)
+        if self.ctl[SHM_MAGIC] != SHM_MAGIC_VALUE:
+            self.detach()
+            return False
+        return True
+
+    def detach(self):
+        """detach() -- release the shared memory."""
+        if self.shm is not None:
+            # the views on the shared memory have to be released before it can be closed
+            self.ctl = None
+            self.ring = None
+            self.ringGeneration = -1
+            self.shm.close()
+            self.shm = None
 
     def disconnect(self):
         """disconnect() -- close a connection."""
+        self.detach()
         if self.isConnected:
             self.sock.close()
             self.sock = []
@@ -242,10 +314,7 @@ class Client:
         if not(self.isConnected):
             raise IOError('Not connected to FieldTrip buffer')
 
-        N = len(request)
-        nw = self.sock.send(request)
-        while nw < N:
-            nw += self.sock.send(request[nw:])
+        self.sock.sendall(request)
 
     def sendRequest(self, command, payload=None):
         if payload is None:
@@ -255,30 +324,59 @@ class Client:
                 'HHI', VERSION, command, len(payload)) + payload
         self.sendRaw(request)
 
-    def receiveResponse(self, minBytes=0):
+    def receiveRaw(self, buf):
         """
-        Receive response from server on socket 's' and return it as
-        (status,bufsize,payload).
+        Receive exactly len(buf) bytes from the socket into the writable
+        buffer 'buf', which can be a bytearray, memoryview or numpy array.
         """
-
-        resp_hdr = self.sock.recv(8)
-        while len(resp_hdr) < 8:
-            resp_hdr += self.sock.recv(8 - len(resp_hdr))
-
-        (version, command, bufsize) = struct.unpack('HHI', resp_hdr)
+        view = memoryview(buf).cast('B')
+        N = len(view)
+        nr = 0
+        while nr < N:
+            n = self.sock.recv_into(view[nr:], N - nr)
+            if n == 0:
+                self.disconnect()
+                raise IOError('Connection closed by buffer server')
+            nr += n
+        return buf
+
+    def receiveHeader(self):
+        """
+        Receive the 8-byte response header from the server and return it as
+        (command,bufsize).
+        """
+        self.receiveRaw(self.respHeader)
+        (version, command, bufsize) = struct.unpack('HHI', self.respHeader)
 
         if version != VERSION:
             self.disconnect()
             raise IOError('Bad response from buffer server - disconnecting')
 
+        return (command, bufsize)
+
+    def receiveResponse(self, minBytes=0):
+        """
+        Receive response from server on socket 's' and return it as
+        (status,bufsize,payload).
+        """
+
+        (command, bufsize) = self.receiveHeader()
+
         if bufsize > 0:
-            payload = self.sock.recv(bufsize)
-            while len(payload) < bufsize:
-                payload += self.sock.recv(bufsize - len(payload))
+            payload = self.receiveRaw(bytearray(bufsize))
         else:
             payload = None
         return (command, bufsize, payload)
 
+    def scratch(self, nbytes):
+        """
+        Return a reusable bytearray of at least 'nbytes' bytes. The buffer is
+        only reallocated when it needs to grow.
+        """
+        if len(self.scratchBuffer) < nbytes:
+            self.scratchBuffer = bytearray(nbytes)
+        return memoryview(self.scratchBuffer)[0:nbytes]
+
     def getHeader(self):
         """
         getHeader() -- grabs header information from the buffer an returns
@@ -318,7 +416,7 @@ class Client:
                 offset += 8
                 if offset + chunk_len > bufsize:
                     break
-                H.chunks[chunk_type] = payload[offset:offset + chunk_len]
+                H.chunks[chunk_type] = bytes(payload[offset:offset + chunk_len])
                 offset += chunk_len
 
             if CHUNK_CHANNEL_NAMES in H.chunks:
@@ -378,14 +476,22 @@ class Client:
             if status != PUT_OK:
                 raise IOError('Header could not be written')
 
-    def getData(self, index=None):
+    def getData(self, index=None, out=None):
         """
-        getData([indices]) -- retrieve data samples and return them as a
+        getData([indices], [out]) -- retrieve data samples and return them as a
         Numpy array, samples in rows(!). The 'indices' argument is optional,
         and if given, must be a tuple or list with inclusive, zero-based
-        start/end indices.
+        start/end indices. The 'out' argument is optional, and if given, must
+        be a Numpy array with one row per sample and one column per channel.
+        The samples are then received directly into it, converting them to
+        the data type of 'out' when needed, and 'out' is returned.
         """
 
+        if self.ctl is not None:
+            D = self.getSharedData(index, out)
+            if D is not None:
+                return D
+
         if index is None:
             request = struct.pack('HHI', VERSION, GET_DAT, 0)
         else:
@@ -394,8 +500,10 @@ class Client:
             request = struct.pack('HHIII', VERSION, GET_DAT, 8, indS, indE)
         self.sendRaw(request)
 
-        (status, bufsize, payload) = self.receiveResponse()
+        (status, bufsize) = self.receiveHeader()
         if status == GET_ERR:
+            if bufsize > 0:
+                self.receiveRaw(self.scratch(bufsize))
             return None
 
         if status != GET_OK:
@@ -406,13 +514,94 @@ class Client:
             self.disconnect()
             raise IOError('Invalid DATA packet received (too few bytes)')
 
-        (nchans, nsamp, datype, bfsiz) = struct.unpack('IIII', payload[0:16])
+        (nchans, nsamp, datype, bfsiz) = struct.unpack(
+            'IIII', self.receiveRaw(self.scratch(16)))
 
         if bfsiz < bufsize - 16 or datype >= len(numpyType):
+            self.disconnect()
             raise IOError('Invalid DATA packet received')
 
-        raw = payload[16:bfsiz + 16]
-        D = numpy.ndarray((nsamp, nchans), dtype=numpyType[datype], buffer=raw)
+        dtype = numpy.dtype(numpyType[datype])
+        nbytes = nsamp * nchans * dtype.itemsize
+        if nbytes > bufsize - 16:
+            self.disconnect()
+            raise IOError('Invalid DATA packet received')
+
+        if out is None:
+            # receive the samples straight into a newly allocated array
+            D = numpy.empty((nsamp, nchans), dtype=dtype)
+            self.receiveRaw(D)
+        elif out.shape != (nsamp, nchans):
+            # the response still has to be read, otherwise the connection gets out of sync
+            self.receiveRaw(self.scratch(bufsize - 16))
+            raise ValueError('Output array has shape %s, expected %s' %
+                             (str(out.shape), str((nsamp, nchans))))
+        elif out.dtype == dtype and out.flags['C_CONTIGUOUS']:
+            # receive the samples straight into the output array
+            D = self.receiveRaw(out)
+        else:
+            # receive the samples in the scratch buffer and convert them
+            raw = self.receiveRaw(self.scratch(nbytes))
+            numpy.copyto(out, numpy.frombuffer(raw, dtype=dtype).reshape(nsamp, nchans), casting='unsafe')
+            D = out
+
+        if bufsize - 16 > nbytes:
+            # discard any trailing bytes
+            self.receiveRaw(self.scratch(bufsize - 16 - nbytes))
+
+        return D
+
+    def getSharedData(self, index=None, out=None):
+        """
+        getSharedData([indices], [out]) -- copy the data samples from the
+        shared memory, like getData. This returns None if the samples are not
+        available in the shared memory, in which case they should be
+        requested from the server.
+        """
+
+        ctl = self.ctl
+        generation = int(ctl[SHM_GENERATION])
+        ringsize = int(ctl[SHM_RINGSIZE])
+        nsamples = int(ctl[SHM_NSAMPLES])
+        if generation % 2 or ringsize < 1:
+            # there is no header, or the server is changing the layout
+            return None
+
+        if generation != self.ringGeneration:
+            nchans = int(ctl[SHM_NCHANS])
+            dtype = numpy.dtype(numpyType[int(ctl[SHM_DATATYPE])])
+            self.ring = numpy.ndarray((ringsize, nchans), dtype=dtype, buffer=self.shm.buf, offset=SHM_OFFSET)
+            self.ringGeneration = generation
+        (ringsize, nchans) = self.ring.shape
+
+        # the oldest sample that is still present in the ring
+        oldest = max(nsamples - ringsize, 0)
+        if index is None:
+            begsample = oldest
+            endsample = nsamples - 1
+        else:
+            begsample = int(index[0])
+            endsample = int(index[1])
+        if begsample < oldest or endsample >= nsamples or begsample > endsample:
+            return None
+
+        nsamp = endsample - begsample + 1
+        if out is None:
+            D = numpy.empty((nsamp, nchans), dtype=self.ring.dtype)
+        elif out.shape != (nsamp, nchans):
+            raise ValueError('Output array has shape %s, expected %s' %
+                             (str(out.shape), str((nsamp, nchans))))
+        else:
+            D = out
+
+        first = begsample % ringsize
+        n = min(nsamp, ringsize - first)
+        numpy.copyto(D[0:n], self.ring[first:first + n], casting='unsafe')
+        numpy.copyto(D[n:], self.ring[0:nsamp - n], casting='unsafe')
+
+        # the copy is only valid if the server did not overwrite the samples in the meantime
+        if ctl[SHM_GENERATION] != generation or ctl[SHM_NWRITING] - ringsize > begsample:
+            return None
 
         return D
 
@@ -539,6 +728,118 @@ class Client:
 
         return struct.unpack('II', resp_buf[0:8])
 
+    def waitForSamples(self, endsample, timeout, begsample=0, interval=0.5, error=True):
+        """
+        waitForSamples(endsample, timeout [, begsample, interval, error]) --
+        block until the sample with the zero-based index 'endsample' is
+        available, using server-side waiting rather than polling the header.
+        The timeout is specified in seconds. A buffer reset is detected when
+        the buffer contains fewer than 'begsample' samples. Returns the number
+        of samples and events as (nSamples, nEvents). If 'error' is False, the
+        number of samples and events is also returned after the timeout,
+        rather than raising an error.
+        """
+        start = time.time()
+        while True:
+            if endsample < 0:
+                (nSamples, nEvents) = self.poll()
+            else:
+                # wait in short intervals, so that a buffer reset is detected
+                remaining = timeout - (time.time() - start)
+                duration = max(min(remaining, interval), 0.001)
+                # the threshold for the events is set such that new events do not end the wait
+                (nSamples, nEvents) = self.wait(endsample, 0xFFFFFFFF, 1000 * duration)
+            if nSamples < begsample:
+                raise RuntimeError("buffer reset detected")
+            if nSamples > endsample:
+                return (nSamples, nEvents)
+            if (time.time() - start) > timeout:
+                if error:
+                    raise RuntimeError("timeout while waiting for data")
+                return (nSamples, nEvents)
+
+
+class SlidingWindow:
+
+    """
+    Class for reading a sliding window with the most recent samples from a
+    FieldTrip buffer. The samples are kept in a local numpy array, so that on
+    every update only the samples that arrived since the previous update have
+    to be transferred.
+    """
+
+    def __init__(self, client, nSamples, dtype='float64'):
+        self.client = client
+        self.nSamples = int(nSamples)
+        self.dtype = numpy.dtype(dtype)
+        self.begsample = -1
+        self.endsample = -1
+        self.clear()
+
+    def clear(self):
+        """clear() -- discard the samples that are kept locally."""
+        self.buffer = None
+        self.stop = 0
+        self.valid = 0
+        self.lastsample = -1
+
+    def resize(self, nSamples):
+        """resize(nSamples) -- change the number of samples in the window."""
+        if int(nSamples) != self.nSamples:
+            self.nSamples = int(nSamples)
+            self.clear()
+
+    def update(self, hdr=None):
+        """
+        update([hdr]) -- retrieve the samples that are new since the previous
+        update and return the most recent nSamples as a Numpy array, samples in
+        rows. The 'hdr' argument is optional, and if given, must be the most
+        recent Header. This returns None if the buffer does not yet contain
+        enough samples. The returned array is a view on the local buffer and
+        is only valid until the next update.
+        """
+
+        if hdr is None:
+            hdr = self.client.getHeader()
+        if hdr is None or self.nSamples < 1 or hdr.nSamples < self.nSamples:
+            return None
+
+        if self.buffer is None or self.buffer.shape[1] != hdr.nChannels:
+            # twice the window length, so that shifting is only needed every nSamples
+            self.buffer = numpy.zeros((2 * self.nSamples, hdr.nChannels), dtype=self.dtype)
+            self.stop = 0
+            self.valid = 0
+
+        endsample = hdr.nSamples - 1
+        begsample = endsample - self.nSamples + 1
+
+        if endsample < self.lastsample:
+            # the buffer was reset, the samples that are kept locally are invalid
+            self.valid = 0
+        elif self.valid > 0 and begsample <= self.lastsample:
+            # only retrieve the samples that are not yet kept locally
+            begsample = self.lastsample + 1
+        else:
+            self.valid = 0
+
+        nNew = endsample - begsample + 1
+        if nNew > 0:
+            if self.stop + nNew > self.buffer.shape[0]:
+                # move the samples that remain part of the window to the start
+                keep = min(self.valid, self.nSamples - nNew)
+                self.buffer[0:keep] = self.buffer[self.stop - keep:self.stop]
+                self.stop = keep
+                self.valid = keep
+            self.client.getData([begsample, endsample], out=self.buffer[self.stop:self.stop + nNew])
+            self.stop += nNew
+            self.valid += nNew
+            self.lastsample = endsample
+
+        self.begsample = endsample - self.nSamples + 1
+        self.endsample = endsample
+        return self.buffer[self.stop - self.nSamples:self.stop]
+
+
 if __name__ == "__main__":
     # Just a small demo for testing purposes...
     # This should be moved to a separate file at some point
@@ -0,0 +1,342 @@
+"""
+FieldTrip buffer (V1) server in pure Python
+
+This implements the same network protocol as the compiled buffer, using
+asyncio for the connections and a preallocated numpy ring for the samples.
+Optionally the ring is placed in shared memory, so that FieldTrip.Client
+instances on the same host can read the samples without a round trip over
+the socket.
+"""
+
+import asyncio
+import collections
+import struct
+import numpy
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # shared memory requires Python 3.8 or later
+    shared_memory = None
+
+from FieldTrip import *
+
+
+class Server:
+
+    """Class for serving a FieldTrip buffer over the network."""
+
+    def __init__(self, port=1972, host='', nsamples=600000, nevents=10000, nbytes=256 * 1024 * 1024, shared=False):
+        self.port = port
+        self.host = host
+        # the size of the ring is limited both in samples and in bytes
+        self.maxsamples = int(nsamples)
+        self.maxevents = int(nevents)
+        self.nbytes = int(nbytes)
+        self.shm = None
+        self.ctl = None
+        if shared:
+            if shared_memory is None:
+                raise RuntimeError('shared memory is not supported on this Python version')
+            name = sharedName(port)
+            try:
+                # remove the shared memory that was left behind by a previous server
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_OFFSET + self.nbytes)
+            self.ctl = numpy.ndarray((8,), dtype='int64', buffer=self.shm.buf)
+            self.ctl[:] = 0
+            self.ctl[SHM_MAGIC] = SHM_MAGIC_VALUE
+        self.server = None
+        self.condition = None
+        self.flushHeader()
+
+    def flushHeader(self):
+        """Discard the header, the samples and the events."""
+        if self.ctl is not None:
+            # an odd generation tells the clients that the layout is changing
+            self.ctl[SHM_GENERATION] += 1
+            self.ctl[SHM_RINGSIZE] = 0
+            self.ctl[SHM_GENERATION] += 1
+        self.header = None
+        self.chunks = b''
+        self.nchans = 0
+        self.datatype = DATATYPE_UNKNOWN
+        self.fsample = 0.
+        self.ring = None
+        self.ringsize = 0
+        self.nsamples = 0
+        self.nevents = 0
+        self.flushData()
+        self.flushEvents()
+
+    def flushData(self):
+        """Discard the samples."""
+        if self.ctl is not None:
+            # samples that are read from the shared memory after this are not valid
+            self.ctl[SHM_GENERATION] += 2
+        self.nsamples = 0
+        self.publish()
+
+    def flushEvents(self):
+        """Discard the events."""
+        self.events = collections.deque(maxlen=self.maxevents)
+        self.nevents = 0
+        self.publish()
+
+    def allocate(self, nchans, datatype):
+        """Allocate the ring for the samples of the new header."""
+        dtype = numpy.dtype(numpyType[datatype])
+        bytespersample = max(nchans * dtype.itemsize, 1)
+        self.ringsize = min(self.maxsamples, self.nbytes // bytespersample)
+        if self.ringsize < 1:
+            raise ValueError('the buffer is too small for a single sample')
+        if self.shm is None:
+            self.ring = numpy.empty((self.ringsize, nchans), dtype=dtype)
+        else:
+            self.ctl[SHM_GENERATION] += 1
+            self.ring = numpy.ndarray((self.ringsize, nchans), dtype=dtype, buffer=self.shm.buf, offset=SHM_OFFSET)
+            self.ctl[SHM_NCHANS] = nchans
+            self.ctl[SHM_DATATYPE] = datatype
+            self.ctl[SHM_RINGSIZE] = self.ringsize
+            self.ctl[SHM_NSAMPLES] = 0
+            self.ctl[SHM_NWRITING] = 0
+            self.ctl[SHM_GENERATION] += 1
+
+    def publish(self):
+        """Update the counters in the shared memory."""
+        if self.ctl is not None:
+            self.ctl[SHM_NSAMPLES] = self.nsamples
+            self.ctl[SHM_NWRITING] = self.nsamples
+            self.ctl[SHM_NEVENTS] = self.nevents
+
+    async def notify(self):
+        """Wake up the clients that are waiting for samples or events."""
+        if self.condition is not None:
+            async with self.condition:
+                self.condition.notify_all()
+
+    def response(self, command, payload=b''):
+        return struct.pack('HHI', VERSION, command, len(payload)) + payload
+
+    def putHeader(self, payload):
+        if len(payload) < 24:
+            return self.response(PUT_ERR)
+        (nchans, nsamp, nevt, fsample, datatype, bufsize) = struct.unpack('IIIfII', payload[0:24])
+        if nchans < 1 or datatype >= len(numpyType) or len(payload) < 24 + bufsize:
+            return self.response(PUT_ERR)
+        self.flushHeader()
+        try:
+            self.allocate(nchans, datatype)
+        except ValueError:
+            return self.response(PUT_ERR)
+        self.nchans = nchans
+        self.datatype = datatype
+        self.fsample = fsample
+        self.chunks = bytes(payload[24:24 + bufsize])
+        self.header = True
+        return self.response(PUT_OK)
+
+    def putData(self, payload):
+        if self.header is None or len(payload) < 16:
+            return self.response(PUT_ERR)
+        (nchans, nsamp, datatype, bufsize) = struct.unpack('IIII', payload[0:16])
+        nbytes = nsamp * nchans * wordSize[datatype] if datatype < len(wordSize) else -1
+        if nchans != self.nchans or datatype != self.datatype or bufsize < nbytes or len(payload) < 16 + nbytes:
+            return self.response(PUT_ERR)
+        D = numpy.frombuffer(payload, dtype=self.ring.dtype, count=nsamp * nchans, offset=16).reshape(nsamp, nchans)
+        if nsamp > self.ringsize:
+            # only the most recent samples fit in the ring
+            D = D[nsamp - self.ringsize:]
+        begsample = self.nsamples + nsamp - len(D)
+        if self.ctl is not None:
+            # tell the clients which samples are about to be overwritten
+            self.ctl[SHM_NWRITING] = self.nsamples + nsamp
+        first = begsample % self.ringsize
+        n = min(len(D), self.ringsize - first)
+        self.ring[first:first + n] = D[0:n]
+        self.ring[0:len(D) - n] = D[n:]
+        # the counter is only updated after the samples have been written
+        self.nsamples += nsamp
+        self.publish()
+        return self.response(PUT_OK)
+
+    def putEvents(self, payload):
+        if self.header is None:
+            return self.response(PUT_ERR)
+        events = []
+        offset = 0
+        while offset + 32 <= len(payload):
+            bufsize = struct.unpack_from('I', payload, offset + 28)[0]
+            if offset + 32 + bufsize > len(payload):
+                return self.response(PUT_ERR)
+            events.append(bytes(payload[offset:offset + 32 + bufsize]))
+            offset += 32 + bufsize
+        if offset != len(payload):
+            return self.response(PUT_ERR)
+        self.events.extend(events)
+        self.nevents += len(events)
+        self.publish()
+        return self.response(PUT_OK)
+
+    def getHeader(self):
+        if self.header is None:
+            return self.response(GET_ERR)
+        hdef = struct.pack('IIIfII', self.nchans, self.nsamples, self.nevents, self.fsample, self.datatype, len(self.chunks))
+        return self.response(GET_OK, hdef + self.chunks)
+
+    def getData(self, payload):
+        if self.header is None:
+            return self.response(GET_ERR)
+        # the oldest sample that is still present in the ring
+        oldest = max(self.nsamples - self.ringsize, 0)
+        if len(payload) >= 8:
+            (begsample, endsample) = struct.unpack('II', payload[0:8])
+        else:
+            (begsample, endsample) = (oldest, self.nsamples - 1)
+        if begsample < oldest or endsample >= self.nsamples or begsample > endsample:
+            return self.response(GET_ERR)
+        nsamp = endsample - begsample + 1
+        nbytes = nsamp * self.ring.strides[0]
+        # the response is assembled in a single buffer, since the ring can change before it is sent
+        response = bytearray(24 + nbytes)
+        struct.pack_into('HHIIIII', response, 0, VERSION, GET_OK, 16 + nbytes, self.nchans, nsamp, self.datatype, nbytes)
+        D = numpy.ndarray((nsamp, self.nchans), dtype=self.ring.dtype, buffer=response, offset=24)
+        first = begsample % self.ringsize
+        n = min(nsamp, self.ringsize - first)
+        D[0:n] = self.ring[first:first + n]
+        D[n:] = self.ring[0:nsamp - n]
+        return response
+
+    def getEvents(self, payload):
+        if self.header is None:
+            return self.response(GET_ERR)
+        oldest = self.nevents - len(self.events)
+        if len(payload) >= 8:
+            (begevent, endevent) = struct.unpack('II', payload[0:8])
+        else:
+            (begevent, endevent) = (oldest, self.nevents - 1)
+        if begevent < oldest or endevent >= self.nevents or begevent > endevent:
+            return self.response(GET_ERR)
+        selection = [self.events[i - oldest] for i in range(begevent, endevent + 1)]
+        return self.response(GET_OK, b''.join(selection))
+
+    async def waitData(self, payload):
+        if self.header is None or len(payload) < 12:
+            return self.response(WAIT_ERR)
+        (nsamples, nevents, timeout) = struct.unpack('III', payload[0:12])
+
+        def ready():
+            return self.nsamples > nsamples or self.nevents > nevents
+
+        if timeout > 0 and not ready():
+            async with self.condition:
+                try:
+                    await asyncio.wait_for(self.condition.wait_for(ready), timeout / 1000.)
+                except asyncio.TimeoutError:
+                    pass
+        return self.response(WAIT_OK, struct.pack('II', self.nsamples, self.nevents))
+
+    async def process(self, command, payload):
+        """Process a single request and return the response, or None if no response is needed."""
+        if command in (PUT_HDR, PUT_HDR_NORESPONSE):
+            response = self.putHeader(payload)
+        elif command in (PUT_DAT, PUT_DAT_NORESPONSE):
+            response = self.putData(payload)
+        elif command in (PUT_EVT, PUT_EVT_NORESPONSE):
+            response = self.putEvents(payload)
+        elif command == GET_HDR:
+            return self.getHeader()
+        elif command == GET_DAT:
+            return self.getData(payload)
+        elif command == GET_EVT:
+            return self.getEvents(payload)
+        elif command == WAIT_DAT:
+            return await self.waitData(payload)
+        elif command == FLUSH_HDR:
+            self.flushHeader()
+            response = self.response(FLUSH_OK)
+        elif command == FLUSH_DAT:
+            self.flushData()
+            response = self.response(FLUSH_OK)
+        elif command == FLUSH_EVT:
+            self.flushEvents()
+            response = self.response(FLUSH_OK)
+        else:
+            return self.response(GET_ERR)
+        await self.notify()
+        if command in (PUT_HDR_NORESPONSE, PUT_DAT_NORESPONSE, PUT_EVT_NORESPONSE):
+            return None
+        return response
+
+    async def handle(self, reader, writer):
+        """Handle the requests of a single client connection."""
+        try:
+            while True:
+                request = await reader.readexactly(8)
+                (version, command, bufsize) = struct.unpack('HHI', request)
+                if version != VERSION:
+                    break
+                if bufsize > 0:
+                    payload = await reader.readexactly(bufsize)
+                else:
+                    payload = b''
+                response = await self.process(command, payload)
+                if response is not None:
+                    writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Start accepting connections."""
+        self.condition = asyncio.Condition()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+
+    async def serve(self):
+        """Start accepting connections and keep serving until cancelled."""
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        """Stop accepting connections and release the shared memory."""
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.shm is not None:
+            self.ring = None
+            self.ctl = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', nargs='*', default=['1972'], help='port number, or comma-separated list of port numbers')
+    parser.add_argument('--nsamples', type=int, default=600000, help='maximum number of samples in the ring')
+    parser.add_argument('--shared', action='store_true', help='place the ring in shared memory')
+    args = parser.parse_args()
+
+    # start one server for each of the ports
+    ports = [int(port) for arg in args.port for port in arg.split(',')]
+
+    async def main():
+        servers = [Server(port, nsamples=args.nsamples, shared=args.shared) for port in ports]
+        try:
+            await asyncio.gather(*[server.serve() for server in servers])
+        finally:
+            for server in servers:
+                server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -221,14 +221,8 @@ def _loop_once():
     # determine when we start polling for available data
     start = time.time()
 
-    while endsample>hdr_input.nSamples-1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
-        if (hdr_input.nSamples-1)<(endsample-window):
-            raise RuntimeError("buffer reset detected")
-        if (time.time()-start)>timeout:
-            raise RuntimeError("timeout while waiting for data")
+    # wait until there is enough data
+    hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(endsample, timeout, begsample)
 
     # get the input data
     dat_input = ft_input.getData([begsample, endsample]).astype(np.double)
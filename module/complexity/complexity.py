@@ -101,7 +101,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input, name
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, shannon, sampen, multiscale, spectral, svd, correlation, higushi, petrosian, fisher, hurst, dfa, lyap_r, lyap_e, window, taper, frequency, begsample, endsample
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, shannon, sampen, multiscale, spectral, svd, correlation, higushi, petrosian, fisher, hurst, dfa, lyap_r, lyap_e, window, taper, frequency, begsample, endsample, ft_window
 
     # this is the timeout for the FieldTrip buffer
     timeout = patch.getfloat('fieldtrip', 'timeout', default=30)
@@ -151,6 +151,9 @@ def _start():
     monitor.trace('taper     = ' + str(taper))
     monitor.trace('frequency = ' + str(frequency))
 
+    # this keeps the most recent samples, only the new ones are read on every iteration
+    ft_window = FieldTrip.SlidingWindow(ft_input, window)
+
     begsample = -1
     endsample = -1
 
@@ -160,21 +163,21 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, shannon, sampen, multiscale, spectral, svd, correlation, higushi, petrosian, fisher, hurst, dfa, lyap_r, lyap_e, window, taper, frequency, begsample, endsample
-    global dat, meandat, chan, sample, metrics, timeseries, metric_names, metric, shortmetric, key, val
-
-    hdr_input = ft_input.getHeader()
-    if (hdr_input.nSamples - 1) < endsample:
-        raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
-        # there are not yet enough samples in the buffer
-        monitor.info('Waiting for data to arrive...')
-        return
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, shannon, sampen, multiscale, spectral, svd, correlation, higushi, petrosian, fisher, hurst, dfa, lyap_r, lyap_e, window, taper, frequency, begsample, endsample, ft_window
+    global dat, meandat, chan, sample, metrics, timeseries, metric_names, metric, shortmetric, key, val, values
+
+    # wait for new data, or until there is enough data for the first window
+    # this also detects a buffer reset, a stalled data stream is not an error
+    while True:
+        hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(max(endsample + 1, window - 1), timeout, endsample + 1, error=False)
+        if hdr_input.nSamples > max(endsample + 1, window - 1):
+            break
+        monitor.info("Waiting for data...")
 
     # get the most recent data segment
     begsample = hdr_input.nSamples - window
     endsample = hdr_input.nSamples - 1
-    dat = ft_input.getData([begsample, endsample]).astype(np.double)
+    dat = ft_window.update(hdr_input)
     dat = dat[:, chanindx]
 
     # subtract the channel mean and apply the taper to each sample
@@ -206,6 +209,8 @@ def _loop_once():
 
     metric_names = list(metrics[0].keys())
 
+    # write all values to Redis in a single round trip
+    values = []
     for chan in chanindx:
         for metric in metric_names:
             shortmetric = metric.lower()
@@ -216,8 +221,9 @@ def _loop_once():
                 shortmetric = shortmetric[len('fractal_dimension_'):]
             key = "{}.{}".format(channame[chan], shortmetric)
             val = metrics[chan][metric]
-            patch.setvalue(key, val)
+            values.append((key, val))
             monitor.update(key, val)
+    patch.setvalues(values)
 
 
 def _loop_forever():
@@ -99,7 +99,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_output, name
-    global nchannels, fsample, shape, scale_frequency, scale_amplitude, scale_offset, scale_noise, scale_dutycycle, offset_frequency, offset_amplitude, offset_offset, offset_noise, offset_dutycycle, blocksize, datatype, block, begsample, endsample, stepsize, timevec, phasevec
+    global nchannels, fsample, shape, scale_frequency, scale_amplitude, scale_offset, scale_noise, scale_dutycycle, offset_frequency, offset_amplitude, offset_offset, offset_noise, offset_dutycycle, blocksize, datatype, block, begsample, endsample, pacer, timevec, phasevec
 
     # get the options from the configuration file
     nchannels = patch.getint('generate', 'nchannels')
@@ -146,7 +146,8 @@ def _start():
     block = 0
     begsample = 0
     endsample = blocksize - 1
-    stepsize = blocksize / fsample
+    # this keeps the real time streaming speed
+    pacer = EEGsynth.pacer(fsample)
 
     # the time axis per block remains the same, the phase linearly increases
     timevec = np.arange(1, blocksize + 1) / fsample
@@ -162,7 +163,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_output
-    global nchannels, fsample, shape, scale_frequency, scale_amplitude, scale_offset, scale_noise, scale_dutycycle, offset_frequency, offset_amplitude, offset_offset, offset_noise, offset_dutycycle, blocksize, datatype, block, begsample, endsample, stepsize, timevec, phasevec
+    global nchannels, fsample, shape, scale_frequency, scale_amplitude, scale_offset, scale_noise, scale_dutycycle, offset_frequency, offset_amplitude, offset_offset, offset_noise, offset_dutycycle, blocksize, datatype, block, begsample, endsample, pacer, timevec, phasevec
     global start, frequency, amplitude, offset, noise, dutycycle, signal, dat_output, chan, elapsed, naptime
 
     if patch.getint('signal', 'rewind', default=0):
@@ -174,6 +175,7 @@ def _loop_once():
     if not patch.getint('signal', 'play', default=1):
         monitor.info("Stopped")
         time.sleep(0.1)
+        pacer.reset()
         # the sample number and phase should be 0 upon the start of the signal
         sample = 0
         phase = 0
@@ -182,6 +184,7 @@ def _loop_once():
     if patch.getint('signal', 'pause', default=0):
         monitor.info("Paused")
         time.sleep(0.1)
+        pacer.reset()
         return
 
     monitor.debug("Generating block " + str(block) + ' from ' + str(begsample) + ' to ' + str(endsample))
@@ -241,6 +244,7 @@ def _loop_once():
     elif datatype == 'float64':
         ft_output.putData(dat_output.astype(np.float64))
 
+    pacer.update(blocksize)
     begsample += blocksize
     endsample += blocksize
     block += 1
@@ -253,20 +257,14 @@ def _loop_once():
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepsize
+    global monitor, pacer
     while True:
-        # measure the time to correct for the slip
-        start = time.time()
-
         monitor.loop()
         _loop_once()
 
-        # correct for the slip
-        elapsed = time.time() - start
-        naptime = stepsize - elapsed
-        if naptime > 0:
-            # this approximates the real time streaming speed
-            time.sleep(naptime)
+        # sleep until the next block is due, this does not accumulate the slip
+        lag = pacer.wait()
+        monitor.debug("lag = %.3f seconds" % lag)
 
 
 def _stop():
@@ -98,7 +98,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input, name
-    global timeout, hdr_input, start, channel, window, threshold, lrate, debounce, key_beat, key_rate, curvemin, curvemean, curvemax, prev, begsample, endsample
+    global timeout, hdr_input, start, channel, window, threshold, lrate, debounce, key_beat, key_rate, curvemin, curvemean, curvemax, prev, begsample, endsample, ft_window
 
     # this is the timeout for the FieldTrip buffer
     timeout = patch.getfloat('fieldtrip', 'timeout', default=30)
@@ -132,6 +132,9 @@ def _start():
     curvemax  = np.nan;
     prev      = np.nan
 
+    # this keeps the most recent samples, only the new ones are read on every iteration
+    ft_window = FieldTrip.SlidingWindow(ft_input, window)
+
     begsample = -1
     endsample = -1
 
@@ -145,21 +148,21 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input
-    global timeout, hdr_input, start, channel, window, threshold, lrate, debounce, key_beat, key_rate, curvemin, curvemean, curvemax, prev, begsample, endsample
+    global timeout, hdr_input, start, channel, window, threshold, lrate, debounce, key_beat, key_rate, curvemin, curvemean, curvemax, prev, begsample, endsample, ft_window
     global dat, negrange, posrange, thresh, prevsample, sample, last, bpm, duration, duration_scale, duration_offset
 
-    hdr_input = ft_input.getHeader()
-    if (hdr_input.nSamples-1)<endsample:
-        raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
-        # there are not yet enough samples in the buffer
-        monitor.info('Waiting for data to arrive...')
-        return
+    # wait for new data, or until there is enough data for the first window
+    # this also detects a buffer reset, a stalled data stream is not an error
+    while True:
+        hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(max(endsample + 1, window - 1), timeout, endsample + 1, error=False)
+        if hdr_input.nSamples > max(endsample + 1, window - 1):
+            break
+        monitor.info("Waiting for data...")
 
     # process the last window
     begsample = hdr_input.nSamples - int(window)
     endsample = hdr_input.nSamples - 1
-    dat       = ft_input.getData([begsample,endsample]).astype(np.double)
+    dat       = ft_window.update(hdr_input)
     dat       = dat[:,channel]
 
     if np.isnan(curvemin):
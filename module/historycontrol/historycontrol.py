@@ -135,7 +135,7 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch
     global monitor, inputlist, enable, stepsize, window, metrics_iqr, metrics_mad, metrics_max, metrics_max_att, metrics_mean, metrics_median, metrics_min, metrics_min_att, metrics_p03, metrics_p16, metrics_p84, metrics_p97, metrics_range, metrics_std, numchannel, numhistory, history, historic
-    global prev_enable, channel, history_att, operation, key, val
+    global prev_enable, channel, history_att, operation, key, val, values
 
     # update the enable status
     prev_enable = enable
@@ -207,12 +207,15 @@ def _loop_once():
         historic['min_att'] = np.nanmin(history_att, axis=1)
         historic['max_att'] = np.nanmax(history_att, axis=1)
 
+    # write all values to Redis in a single round trip
+    values = []
     for operation in list(historic.keys()):
         for channel in range(numchannel):
             key = inputlist[channel] + "." + operation
             val = historic[operation][channel]
-            patch.setvalue(key, val)
+            values.append((key, val))
             monitor.debug('%s = %g' % (key, val))
+    patch.setvalues(values)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -161,7 +161,7 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input
     global timeout, hdr_input, start, inputlist, prefix, enable, stepsize, window, numhistory, numchannel, history, historic, begsample, endsample
-    global prev_enable, dat_input, chanindx, operation, key, val
+    global prev_enable, dat_input, chanindx, operation, key, val, values
 
     # determine the start of the actual processing
     start = time.time()
@@ -187,14 +187,8 @@ def _loop_once():
         time.sleep(patch.getfloat('general', 'delay'))
         return
 
-    while endsample > hdr_input.nSamples-1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
-        if hdr_input.nSamples < begsample:
-            raise RuntimeError("buffer reset detected")
-        if (time.time()-start) > timeout:
-            raise RuntimeError("timeout while waiting for data")
+    # wait until there is enough data
+    hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(endsample, timeout, begsample)
 
     monitor.debug("reading samples " + str(begsample) + " to " + str(endsample))
 
@@ -226,10 +220,13 @@ def _loop_once():
         # see https://en.wikipedia.org/wiki/Interquartile_range
         historic['iqr']     = historic['p84'] - historic['p16']
 
+    # write all values to Redis in a single round trip
+    values = []
     for operation in list(historic.keys()):
         key = prefix + "." + operation
         val = historic[operation]
-        patch.setvalue(key, val, debug > 1)
+        values.append((key, val))
+    patch.setvalues(values, debug > 1)
 
     begsample += stepsize
     endsample += stepsize
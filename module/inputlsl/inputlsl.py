@@ -21,6 +21,7 @@
 
 import configparser
 import argparse
+import numpy as np
 import os
 import redis
 import sys
@@ -49,6 +50,14 @@ sys.path.insert(0, os.path.join(path, '../../lib'))
 import EEGsynth
 
 
+def tofloat(x):
+    # interpret the LSL marker string as a numerical value
+    try:
+        return float(x)
+    except ValueError:
+        return float('nan')
+
+
 def _setup():
     '''Initialize the module
     This adds a set of global variables
@@ -82,6 +91,7 @@ def _start():
     '''
     global parser, args, config, r, response, patch, name
     global monitor, delay, timeout, lsl_name, lsl_type, lsl_format, output_prefix, start, selected, streams, stream, inlet, type, source_id, match, lsl_id
+    global maxchunk, publish, channel_count, channel, label, keys, i
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -93,6 +103,8 @@ def _start():
     lsl_type = patch.getstring('lsl', 'type')
     lsl_format = patch.getstring('lsl', 'format')
     output_prefix = patch.getstring('output', 'prefix')
+    publish = patch.getstring('output', 'publish', default='all')
+    maxchunk = patch.getint('lsl', 'maxchunk', default=1024)
 
     monitor.info("looking for an LSL stream...")
     start = time.time()
@@ -134,6 +146,21 @@ def _start():
     lsl_id = inlet.info().source_id()
     monitor.success('connected to LSL stream %s (type = %s, id = %s)' % (lsl_name, lsl_type, lsl_id))
 
+    # with format=value, each of the channels is written to its own Redis key
+    channel_count = inlet.info().channel_count()
+    if channel_count == 1:
+        keys = ['%s.%s.%s' % (output_prefix, lsl_name, lsl_type)]
+    else:
+        # use the channel labels from the stream description, or otherwise the channel number starting with 1
+        keys = []
+        channel = inlet.info().desc().child('channels').child('channel')
+        for i in range(channel_count):
+            label = channel.child_value('label') if not channel.empty() else ''
+            if len(label)==0:
+                label = '%d' % (i + 1)
+            keys.append('%s.%s.%s.%s' % (output_prefix, lsl_name, lsl_type, label))
+            channel = channel.next_sibling()
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -145,30 +172,53 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch
     global monitor, delay, timeout, lsl_name, lsl_type, lsl_format, output_prefix, start, selected, streams, stream, inlet, type, source_id, match, lsl_id
-    global sample, timestamp
+    global maxchunk, publish, channel_count, channel, label, keys, i
+    global chunk, timestamps, dat, scale, offset, items, key, val, sample, timestamp
 
+    # wait for the first sample, and subsequently collect the samples that are already waiting
+    # pull_chunk would wait until maxchunk samples have arrived or until the whole timeout has passed
     sample, timestamp = inlet.pull_sample(timeout=delay)
-    if not sample == None:
+    if timestamp is not None:
+        if maxchunk > 1:
+            chunk, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=maxchunk - 1)
+            chunk, timestamps = [sample] + list(chunk), [timestamp] + list(timestamps)
+        else:
+            chunk, timestamps = [sample], [timestamp]
+    else:
+        chunk, timestamps = [], []
+
+    if timestamps:
 
         if lsl_format == 'value':
-            # interpret the LSL marker string as a numerical value
             try:
-                val = float(sample[0])
+                dat = np.asarray(chunk, dtype=float)
             except ValueError:
-                val = float('nan')
-            # the scale and offset options can be changed on the fly
-            scale = patch.getfloat('lsl', 'scale', default=1. / 127)
-            offset = patch.getfloat('lsl', 'offset', default=0.)
-            val = EEGsynth.rescale(val, slope=scale, offset=offset)
-            name = '%s.%s.%s' % (output_prefix, lsl_name, lsl_type)
+                dat = np.array([[tofloat(x) for x in sample] for sample in chunk])
+            # the scale and offset options can be changed on the fly, they are retrieved once per chunk
+            scale, offset = patch.getfloats([('lsl', 'scale'), ('lsl', 'offset')])
+            if scale is None:
+                scale = 1. / 127
+            if offset is None:
+                offset = 0.
+            dat = scale * dat + offset
+            if publish == 'latest':
+                # only the most recent value of each channel
+                items = list(zip(keys, dat[-1].tolist()))
+            else:
+                items = [(key, val) for sample in dat.tolist() for key, val in zip(keys, sample)]
+            for key, val in zip(keys, dat[-1].tolist()):
+                monitor.update(key, val)
         else:
             # use the marker string as the name, and use an arbitrary value
-            name = '%s.%s.%s.%s' % (output_prefix, lsl_name, lsl_type, sample[0])
-            val = 1.
-
-        # send the Redis message
-        patch.setvalue(name, val)
-        monitor.update(name, val)
+            items = [('%s.%s.%s.%s' % (output_prefix, lsl_name, lsl_type, sample[0]), 1.) for sample in chunk]
+            if publish == 'latest':
+                # each of the markers only once
+                items = list(dict(items).items())
+            for key, val in items:
+                monitor.update(key, val)
+
+        # send all Redis messages in a single pipeline
+        patch.setvalues(items)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
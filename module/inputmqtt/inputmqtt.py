@@ -70,7 +70,7 @@ def on_message(client, userdata, msg):
             # assume that it is a single scalar value
             val = EEGsynth.rescale(float(msg.payload), slope=output_scale, offset=output_offset)
             monitor.update(key, val)
-            patch.setvalue(key, val)
+            ingest.put(key, val)
         except:
             pass
 
@@ -119,7 +119,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, client, name
-    global monitor, debug, prefix, output_scale, output_offset, input_channels, channel
+    global monitor, debug, prefix, output_scale, output_offset, input_channels, channel, ingest
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -132,6 +132,10 @@ def _start():
     output_scale = patch.getfloat('output', 'scale', default=1)
     output_offset = patch.getfloat('output', 'offset', default=0)
 
+    # the incoming values are collected and written to Redis in batches
+    ingest = EEGsynth.ingest(patch, window=patch.getfloat('output', 'window', default=0.01), monitor=monitor)
+    ingest.start()
+
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
@@ -154,12 +158,16 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch, client
     global monitor, debug, prefix, output_scale, output_offset, input_channels, channel
-    global output_scale, output_offset
+    global output_scale, output_offset, ingest
 
     # update the scale and offset
     output_scale = patch.getfloat('output', 'scale', default=1)
     output_offset = patch.getfloat('output', 'offset', default=0)
 
+    # report the state of the queue with values that are to be written to Redis
+    monitor.debug('queue depth = %d, received = %d, written = %d, dropped = %d' % (ingest.depth(), ingest.received, ingest.written, ingest.dropped))
+    monitor.update('dropped', ingest.dropped)
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -178,9 +186,10 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, client
+    global monitor, client, ingest
     monitor.success("Closing module...")
     client.loop_stop(force=False)
+    ingest.stop()
     monitor.success("Done.")
     sys.exit()
 
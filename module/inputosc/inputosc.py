@@ -70,7 +70,7 @@ import EEGsynth
 
 # the server will call this message handler function upon incoming messages
 def python2_message_handler(addr, tags, data, source):
-    global monitor, patch, prefix, output_scale, output_offset
+    global monitor, ingest, prefix, output_scale, output_offset
 
     monitor.debug("addr = %s, tags = %s, data = %s, source %s" % (addr, tags, data, OSC.getUrlStr(source)))
 
@@ -82,7 +82,7 @@ def python2_message_handler(addr, tags, data, source):
         # it is a single scalar value
         key = prefix + addr.replace('/', '.')
         val = EEGsynth.rescale(data[0], slope=output_scale, offset=output_offset)
-        patch.setvalue(key, val)
+        ingest.put(key, val)
 
     else:
         for i in range(len(data)):
@@ -90,20 +90,20 @@ def python2_message_handler(addr, tags, data, source):
             # append the index to the key, this starts with 1
             key = prefix + addr.replace('/', '.') + '.%i' % (i + 1)
             val = EEGsynth.rescale(data[i], slope=output_scale, offset=output_offset)
-            patch.setvalue(key, val)
+            ingest.put(key, val)
             monitor.update(key, val)
 
 
 # the server will call the message handler function upon incoming messages
 def python3_message_handler(addr, data):
-    global monitor, patch, prefix, output_scale, output_offset
+    global monitor, ingest, prefix, output_scale, output_offset
 
     monitor.debug("addr = %s, data = %s" % (addr, data))
 
     # assume that it is a single scalar value
     key = prefix + addr.replace('/', '.')
     val = EEGsynth.rescale(data, slope=output_scale, offset=output_offset)
-    patch.setvalue(key, val)
+    ingest.put(key, val)
     monitor.update(key, val)
 
 
@@ -140,7 +140,7 @@ def _start():
     '''
     global parser, args, config, r, response, patch, name
     global use_old_version, dispatcher, osc_server
-    global monitor, debug, osc_address, osc_port, prefix, output_scale, output_offset
+    global monitor, debug, osc_address, osc_port, prefix, output_scale, output_offset, ingest, s, st
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -155,6 +155,10 @@ def _start():
     output_scale = patch.getfloat('output', 'scale', default=1)
     output_offset = patch.getfloat('output', 'offset', default=0)
 
+    # the incoming values are collected and written to Redis in batches
+    ingest = EEGsynth.ingest(patch, window=patch.getfloat('output', 'window', default=0.01), monitor=monitor)
+    ingest.start()
+
     try:
         if use_old_version:
             monitor.success('Starting old version with', osc_address, osc_port)
@@ -173,8 +177,11 @@ def _start():
             monitor.success('Starting new version with', osc_address, osc_port)
             dispatcher = dispatcher.Dispatcher()
             dispatcher.set_default_handler(python3_message_handler)
-            server = osc_server.ThreadingOSCUDPServer((osc_address, osc_port), dispatcher)
-            server.serve_forever() # this is blocking
+            # the messages are handled one after the other, rather than each in its own thread
+            s = osc_server.BlockingOSCUDPServer((osc_address, osc_port), dispatcher)
+            # start the server thread
+            st = threading.Thread(target=s.serve_forever)
+            st.start()
         monitor.success("Started OSC server")
     except:
         raise RuntimeError("Cannot start OSC server")
@@ -190,16 +197,15 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global use_old_version, output_scale, output_offset
+    global use_old_version, output_scale, output_offset, monitor, ingest
 
-    # keep looping while incoming OSC messages are being handled
-    if use_old_version:
-        # update the scale and offset
-        output_scale = patch.getfloat('output', 'scale', default=1)
-        output_offset = patch.getfloat('output', 'offset', default=0)
-    else:
-        # the code will never get here when using pythonosc with Python3, since that is blocking
-        pass
+    # the incoming OSC messages are handled in the server thread, update the scale and offset
+    output_scale = patch.getfloat('output', 'scale', default=1)
+    output_offset = patch.getfloat('output', 'offset', default=0)
+
+    # report the state of the queue with values that are to be written to Redis
+    monitor.debug('queue depth = %d, received = %d, written = %d, dropped = %d' % (ingest.depth(), ingest.received, ingest.written, ingest.dropped))
+    monitor.update('dropped', ingest.dropped)
 
 
 def _loop_forever():
@@ -215,13 +221,17 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global use_old_version, monitor, s, st
+    global use_old_version, monitor, s, st, ingest
+    monitor.success("Closing module...")
     if use_old_version:
-        monitor.success("Closing module...")
         s.close()
-        monitor.info("Waiting for OSC server thread to finish.")
-        st.join()
-        monitor.success("Done.")
+    else:
+        s.shutdown()
+        s.server_close()
+    monitor.info("Waiting for OSC server thread to finish.")
+    st.join()
+    ingest.stop()
+    monitor.success("Done.")
     sys.exit()
 
 
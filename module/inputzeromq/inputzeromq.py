@@ -92,7 +92,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, context, socket, patch
-    global monitor, debug, prefix, output_scale, output_offset, input_channels
+    global monitor, debug, prefix, output_scale, output_offset, input_channels, ingest
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -105,6 +105,10 @@ def _start():
     output_scale = patch.getfloat('output', 'scale', default=1)
     output_offset = patch.getfloat('output', 'offset', default=0)
 
+    # the incoming values are collected and written to Redis in batches
+    ingest = EEGsynth.ingest(patch, window=patch.getfloat('output', 'window', default=0.01), monitor=monitor)
+    ingest.start()
+
     input_channels = patch.getstring('input', 'channels', multiple=True)
     if len(input_channels) == 0:
         monitor.info('subscribed to everything')
@@ -127,13 +131,14 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, context, socket, patch
-    global monitor, debug, prefix, output_scale, output_offset, input_channels
-    global start
+    global monitor, debug, prefix, output_scale, output_offset, input_channels, ingest
+    global start, delay, message, key, val
 
     start = time.time()
+    delay = patch.getfloat('general', 'delay')
 
     # process all messages that are waiting
-    while (time.time() - start) < patch.getfloat('general', 'delay'):
+    while (time.time() - start) < delay:
         try:
             # this will timeout after the specified delay
             message = socket.recv_string()
@@ -148,12 +153,16 @@ def _loop_once():
         # assume that it is a single scalar value
         val = EEGsynth.rescale(float(val), slope=output_scale, offset=output_offset)
         monitor.update(key, val)
-        patch.setvalue(key, val)
+        ingest.put(key, val)
 
     # update the scale and offset, these values are updated after every delay
     output_scale = patch.getfloat('output', 'scale', default=1)
     output_offset = patch.getfloat('output', 'offset', default=0)
 
+    # report the state of the queue with values that are to be written to Redis
+    monitor.debug('queue depth = %d, received = %d, written = %d, dropped = %d' % (ingest.depth(), ingest.received, ingest.written, ingest.dropped))
+    monitor.update('dropped', ingest.dropped)
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -171,8 +180,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, socket, context
+    global monitor, socket, context, ingest
     monitor.success("Closing module...")
+    ingest.stop()
     socket.close()
     context.destroy()
     monitor.success("Done.")
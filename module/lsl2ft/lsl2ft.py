@@ -84,6 +84,7 @@ def _start():
     '''
     global parser, args, config, r, response, patch, name
     global monitor, timeout, lsl_name, lsl_type, ft_host, ft_port, ft_output, start, selected, streams, stream, inlet, type, source_id, match, lsl_id, channel_count, channel_format, nominal_srate, samples, blocksize
+    global dejitter, maxchunk, latency, maxgap, dtype, dest, block, nblock, blockstart, tgrid, last, padded
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -92,6 +93,10 @@ def _start():
     timeout = patch.getfloat('lsl', 'timeout', default=30)
     lsl_name = patch.getstring('lsl', 'name')
     lsl_type = patch.getstring('lsl', 'type')
+    dejitter = patch.getint('lsl', 'dejitter', default=1)
+    maxchunk = patch.getint('lsl', 'maxchunk', default=1024)
+    latency = patch.getfloat('lsl', 'latency', default=0.05)
+    maxgap = patch.getfloat('lsl', 'maxgap', default=1)
 
     try:
         ft_host = patch.getstring('fieldtrip', 'hostname')
@@ -135,7 +140,11 @@ def _start():
         monitor.success('-------------------------')
 
     # create a new inlet from the first (and hopefully only) selected stream
-    inlet = lsl.StreamInlet(selected[0])
+    if dejitter and hasattr(lsl, 'proc_dejitter'):
+        # the timestamps are mapped onto the local clock and smoothed by LSL
+        inlet = lsl.StreamInlet(selected[0], processing_flags=lsl.proc_clocksync | lsl.proc_dejitter)
+    else:
+        inlet = lsl.StreamInlet(selected[0])
 
     # give some feedback
     lsl_name = inlet.info().name()
@@ -147,11 +156,41 @@ def _start():
     channel_format = inlet.info().channel_format()
     nominal_srate = inlet.info().nominal_srate()
 
+    # the samples are pulled from LSL straight into this preallocated array
+    if channel_format == lsl.cf_float32:
+        dtype = np.float32
+    elif channel_format == lsl.cf_double64:
+        dtype = np.float64
+    elif channel_format == lsl.cf_int32:
+        dtype = np.int32
+    elif channel_format == lsl.cf_int16:
+        dtype = np.int16
+    elif channel_format == lsl.cf_int8:
+        dtype = np.int8
+    elif channel_format == lsl.cf_int64:
+        dtype = np.int64
+    else:
+        raise RuntimeError("unsupported channel format of the LSL stream")
+    dest = np.zeros((maxchunk, channel_count), dtype=dtype)
+
+    # the chunks are coalesced into blocks that span the target latency
+    if nominal_srate > 0:
+        blocksize = max(int(round(latency * nominal_srate)), 1)
+    else:
+        blocksize = maxchunk
+    block = np.zeros((blocksize + maxchunk, channel_count), dtype=np.float32)
+    nblock = 0
+    blockstart = None
+
     ft_output.putHeader(channel_count, nominal_srate, FieldTrip.DATATYPE_FLOAT32)
 
+    # the time on the regular sampling grid and the value of the previous sample are used to fill the gaps
+    tgrid = None
+    last = None
+
     # this is used for feedback
     samples = 0
-    blocksize = 1
+    padded = 0
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -164,18 +203,78 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch
     global monitor, timeout, lsl_name, lsl_type, ft_host, ft_port, ft_output, start, selected, streams, stream, inlet, type, source_id, match, lsl_id, channel_count, channel_format, nominal_srate, samples, blocksize
+    global dejitter, maxchunk, latency, maxgap, dtype, dest, block, nblock, blockstart, tgrid, last, padded
 
-    chunk, timestamps = inlet.pull_chunk()
+    global chunk, timestamps, dat, missing, pos, xp, fp, k, j, w, now, wait
+
+    now = time.time()
+    if blockstart is None:
+        wait = latency
+    else:
+        # do not wait longer than needed to send the block in time
+        wait = max(blockstart + latency - now, 0)
+
+    chunk, timestamps = inlet.pull_chunk(timeout=wait, max_samples=maxchunk, dest_obj=dest)
     if timestamps:
-        dat = np.asarray(chunk, dtype=np.float32)
-        ft_output.putData(dat)
-        blocksize = dat.shape[0]
-        samples += blocksize
+        dat = dest[0:len(timestamps)]
+
+        if nominal_srate > 0:
+            if tgrid is None:
+                tgrid = timestamps[0] - 1. / nominal_srate
+            # the position of each sample on the regular sampling grid follows from its timestamp
+            pos = np.round((np.asarray(timestamps) - tgrid) * nominal_srate).astype(int)
+            # samples that arrive early due to jitter or to a faster clock are simply appended, so the grid position
+            # of each sample is at least one after that of the previous one, which keeps the grid in line with the output
+            pos = np.arange(1, len(pos) + 1) + np.maximum.accumulate(np.maximum(pos - np.arange(1, len(pos) + 1), 0))
+            # the number of samples that are missing before each sample
+            missing = np.diff(pos, prepend=0) - 1
+            if np.any(missing > maxgap * nominal_srate):
+                # the stream was interrupted for too long to fill the gap
+                missing[missing > maxgap * nominal_srate] = 0
+                tgrid = None
+            if np.any(missing):
+                # fill the gaps by linear interpolation between the samples on both sides
+                pos = np.cumsum(missing + 1)
+                xp = np.concatenate(([0], pos))
+                fp = np.concatenate((dat[0:1] if last is None else last[np.newaxis,:], dat)).astype(np.float32)
+                k = np.arange(1, pos[-1] + 1)
+                j = np.searchsorted(xp, k)
+                w = ((k - xp[j - 1]) / (xp[j] - xp[j - 1])).astype(np.float32)
+                dat = fp[j - 1] + w[:, np.newaxis] * (fp[j] - fp[j - 1])
+                padded += int(np.sum(missing))
+                monitor.update('padded', padded)
+
+            if tgrid is None:
+                # start a new grid after a long interruption
+                tgrid = timestamps[-1]
+            else:
+                # follow the grid by the number of samples that are sent, and slowly correct it for drift between the clocks
+                tgrid += len(dat) / nominal_srate
+                tgrid += 0.1 * (timestamps[-1] - tgrid)
+
+        last = np.array(dat[-1], dtype=np.float32)
+
+        if nblock + len(dat) > len(block):
+            # make room in the block
+            ft_output.putData(block[0:nblock])
+            nblock = 0
+            blockstart = None
+        if len(dat) > len(block):
+            # this only happens after a large gap
+            ft_output.putData(dat.astype(np.float32))
+        else:
+            if blockstart is None:
+                blockstart = now
+            block[nblock:nblock + len(dat)] = dat
+            nblock += len(dat)
+        samples += len(dat)
         monitor.update('samples', samples)
-    else:
-        # wait for a short time before trying again
-        # this prevents the polling from clogging the CPU to 100%
-        time.sleep(0.1 * blocksize / nominal_srate)
+
+    # send the block when it spans the target latency, or when it has been waiting for that long
+    if nblock >= blocksize or (nblock > 0 and (time.time() - blockstart) >= latency):
+        ft_output.putData(block[0:nblock])
+        nblock = 0
+        blockstart = None
 
 
 def _loop_forever():
@@ -21,6 +21,7 @@
 
 import configparser
 import argparse
+import numpy as np
 import os
 import redis
 import serial
@@ -82,7 +83,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, address, artnet, dmxsize, dmxframe, prevtime
+    global monitor, debug, universe, address, artnet, dmxsize, chanindx, chanstr, items
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general','debug'))
@@ -90,30 +91,27 @@ def _start():
     # get the options from the configuration file
     debug = patch.getint('general','debug')
 
-    # prepare the data for a single universe
-    address = [0, 0, patch.getint('artnet','universe')]
-    artnet = ArtNet.ArtNet(ip=patch.getstring('artnet','broadcast'), port=patch.getint('artnet','port'))
-
-    # determine the size of the universe
-    dmxsize = 0
-    chanlist, chanvals = list(map(list, list(zip(*config.items('input')))))
-    for chanindx in range(0, 512):
-        chanstr = "channel%03d" % (chanindx + 1)
-        if chanstr in chanlist:
-            # the last channel determines the size
-            dmxsize = chanindx + 1
+    # prepare the data for one or multiple universes
+    universe = patch.getint('artnet','universe', multiple=True)
+    address = [[0, 0, u] for u in universe]
 
     # FIXME the artnet code fails if the size is smaller than 512
     dmxsize = 512
     monitor.info("universe size = %d" % dmxsize)
 
-    # make an empty frame
-    dmxframe = [0] * dmxsize
-    # blank out
-    artnet.broadcastDMX(dmxframe, address)
+    # this keeps a frame for each universe, and sends the ones that changed followed by a sync packet
+    artnet = ArtNet.ArtNetSender(address, ip=patch.getstring('artnet','broadcast'), port=patch.getint('artnet','port'), size=dmxsize, keepalive=0.5, sync=patch.getint('artnet','sync', default=1))
+
+    # determine the channels that are specified, these are 1-offset in the ini file
+    # the channels are numbered consecutively over the universes, i.e. channel513 is the first of the second universe
+    chanindx = np.array([i for i in range(len(universe) * dmxsize) if config.has_option('input', "channel%03d" % (i + 1))], dtype=int)
+    chanstr = ["channel%03d" % (i + 1) for i in chanindx]
 
-    # keep a timer to send a packet every now and then
-    prevtime = time.time()
+    # the input, scale and offset of all channels are retrieved from Redis in a single round trip
+    items = [('input', c) for c in chanstr] + [('scale', c) for c in chanstr] + [('offset', c) for c in chanstr]
+
+    # blank out
+    artnet.send(force=True)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -125,44 +123,29 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, debug, address, artnet, dmxsize, dmxframe, prevtime
-    global update, chanindx, chanstr, chanval, scale, offset
-
-    update = False
-
-    # loop over the control values, these are 1-offset in the ini file
-    for chanindx in range(0, dmxsize):
-        chanstr = "channel%03d" % (chanindx + 1)
-        # this returns None when the channel is not present
-        chanval = patch.getfloat('input', chanstr)
-
-        if chanval == None:
-            # the value is not present in Redis, skip it
-            continue
-
-        # the scale and offset options are channel specific
-        scale = patch.getfloat('scale', chanstr, default=255)
-        offset = patch.getfloat('offset', chanstr, default=0)
-        # apply the scale and offset
-        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-        # ensure that it is within limits
-        chanval = EEGsynth.limit(chanval, lo=0, hi=255)
-        chanval = int(chanval)
-
-        # only update if the value has changed
-        if dmxframe[chanindx] != chanval:
-            monitor.info("DMX channel%03d = %g" % (chanindx, chanval))
-            dmxframe[chanindx] = chanval
-            update = True
-
-    if update:
-        artnet.broadcastDMX(dmxframe, address)
-        prevtime = time.time()
-
-    elif (time.time() - prevtime) > 0.5:
-        # send a maintenance frame every 0.5 seconds
-        artnet.broadcastDMX(dmxframe, address)
-        prevtime = time.time()
+    global monitor, debug, universe, address, artnet, dmxsize, chanindx, chanstr, items
+    global chanval, scale, offset, present, indx, changed, i, val
+
+    # this returns NaN for the channels that are not present
+    chanval, scale, offset = np.array(patch.getfloats(items), dtype=float).reshape(3, -1)
+
+    # the scale and offset options are channel specific
+    scale[np.isnan(scale)] = 255
+    offset[np.isnan(offset)] = 0
+
+    # the channels that are not present in Redis are skipped
+    present = ~np.isnan(chanval)
+    indx = chanindx[present]
+    # apply the scale and offset, and ensure that it is within limits
+    chanval = np.clip(scale[present] * chanval[present] + offset[present], 0, 255).astype(np.uint8)
+
+    changed = artnet.frame.flat[indx] != chanval
+    for i, val in zip(indx[changed], chanval[changed]):
+        monitor.info("DMX channel%03d = %g" % (i, val))
+    artnet.frame.flat[indx] = chanval
+
+    # only the universes that have changed are sent, the others every 0.5 seconds
+    artnet.send()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -185,19 +168,10 @@ def _stop():
     global monitor, artnet
     monitor.success("Closing module...")
     # blank out
-    dmxframe = [0] * 512
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
-    artnet.broadcastDMX(dmxframe,address)
-    time.sleep(0.1) # this seems to take some time
+    artnet.frame[:] = 0
+    for repeat in range(6):
+        artnet.send(force=True)
+        time.sleep(0.1) # this seems to take some time
     artnet.close()
     sys.exit()
 
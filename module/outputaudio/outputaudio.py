@@ -260,20 +260,8 @@ def _loop_once():
     # measure the time that it takes
     start = time.time()
 
-    # wait only shortly, update the header after waiting
-    # this fails when the data streams is stalled or when the buffer resets
-    hdr_input.nSamples, hdr_input.nEvents = ft_input.wait(endsample, 0, 2000*window/hdr_input.fSample)
-
-    # wait longer when needed, poll the buffer for new data
-    # this deals with the case when the data streams is stalled or when the buffer resets
-    while endsample > hdr_input.nSamples - 1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
-        if (hdr_input.nSamples - 1) < (endsample - window):
-            raise RuntimeError("buffer reset detected")
-        if (time.time() - start) > timeout:
-            raise RuntimeError("timeout while waiting for data")
+    # wait until there is enough data, this also detects a buffer reset
+    hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(endsample, timeout, begsample)
 
     # the output audio is float32, hence this should be as well
     dat = ft_input.getData([begsample, endsample]).astype(np.single)
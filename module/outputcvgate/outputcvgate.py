@@ -64,59 +64,44 @@ def SetGate(chanindx, chanval):
         s.write(b'*g%dv%d#' % (chanindx, chanval))
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel, chanindx, chanstr):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.chanindx = chanindx
         self.chanstr = chanstr
-        self.running = True
-
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        pubsub = r.pubsub()
-        # this message unblocks the Redis listen command
-        pubsub.subscribe('OUTPUTCVGATE_UNBLOCK')
-        # this message triggers the event
-        pubsub.subscribe(self.redischannel)
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    chanval = float(item['data'])
-
-                    if self.chanstr.startswith('cv'):
-                        # the value should be between 0 and 4095
-                        scale = patch.getfloat('scale', self.chanstr, default=4095)
-                        offset = patch.getfloat('offset', self.chanstr, default=0)
-                        # apply the scale and offset
-                        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-                        chanval = EEGsynth.limit(chanval, lo=0, hi=4095)
-                        chanval = int(chanval)
-                        SetControl(self.chanindx, chanval)
-                        monitor.update(self.chanstr, chanval)
-
-                    elif self.chanstr.startswith('gate'):
-                        # the value should be 0 or 1
-                        scale = patch.getfloat('scale', self.chanstr, default=1)
-                        offset = patch.getfloat('offset', self.chanstr, default=0)
-                        # apply the scale and offset
-                        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-                        chanval = int(chanval > 0)
-                        SetGate(self.chanindx, chanval)
-                        monitor.update(self.chanstr, chanval)
-
-                        # schedule a timer to switch the gate off after the specified duration
-                        duration = patch.getfloat('duration', self.chanstr, default=None)
-                        if duration != None:
-                            duration = EEGsynth.rescale(duration, slope=duration_scale, offset=duration_offset)
-                            # some minimal time is needed for the delay
-                            duration = EEGsynth.limit(duration, 0.05, float('Inf'))
-                            t = threading.Timer(duration, SetGate, args=[self.chanindx, False])
-                            t.start()
+
+    def __call__(self, item):
+        chanval = float(item['data'])
+
+        if self.chanstr.startswith('cv'):
+            # the value should be between 0 and 4095
+            scale = patch.getfloat('scale', self.chanstr, default=4095)
+            offset = patch.getfloat('offset', self.chanstr, default=0)
+            # apply the scale and offset
+            chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
+            chanval = EEGsynth.limit(chanval, lo=0, hi=4095)
+            chanval = int(chanval)
+            SetControl(self.chanindx, chanval)
+            monitor.update(self.chanstr, chanval)
+
+        elif self.chanstr.startswith('gate'):
+            # the value should be 0 or 1
+            scale = patch.getfloat('scale', self.chanstr, default=1)
+            offset = patch.getfloat('offset', self.chanstr, default=0)
+            # apply the scale and offset
+            chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
+            chanval = int(chanval > 0)
+            SetGate(self.chanindx, chanval)
+            monitor.update(self.chanstr, chanval)
+
+            # schedule a timer to switch the gate off after the specified duration
+            duration = patch.getfloat('duration', self.chanstr, default=None)
+            if duration != None:
+                duration = EEGsynth.rescale(duration, slope=duration_scale, offset=duration_offset)
+                # some minimal time is needed for the delay
+                duration = EEGsynth.limit(duration, 0.05, float('Inf'))
+                t = threading.Timer(duration, SetGate, args=[self.chanindx, False])
+                t.start()
 
 
 def _setup():
@@ -150,7 +135,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, duration_scale, duration_offset, serialdevice, s, lock, trigger, chanindx, chanstr, redischannel, thread
+    global monitor, duration_scale, duration_offset, serialdevice, s, lock, trigger, chanindx, chanstr, redischannel, this, dispatcher
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -174,24 +159,26 @@ def _start():
     lock = threading.Lock()
 
     trigger = []
-    # configure the trigger threads for the control voltages
+    # configure the triggers for the control voltages
     for chanindx in range(1, 5):
         chanstr = "cv%d" % chanindx
         if patch.hasitem('trigger', chanstr):
             redischannel = patch.getstring('trigger', chanstr)
-            trigger.append(TriggerThread(redischannel, chanindx, chanstr))
+            trigger.append(Trigger(redischannel, chanindx, chanstr))
             monitor.info("configured " + redischannel + " on " + str(chanindx))
-    # configure the trigger threads for the gates
+    # configure the triggers for the gates
     for chanindx in range(1, 5):
         chanstr = "gate%d" % chanindx
         if patch.hasitem('trigger', chanstr):
             redischannel = patch.getstring('trigger', chanstr)
-            trigger.append(TriggerThread(redischannel, chanindx, chanstr))
+            trigger.append(Trigger(redischannel, chanindx, chanstr))
             monitor.info("configured " + redischannel + " on " + str(chanindx))
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -203,7 +190,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, duration_scale, duration_offset, serialdevice, s, lock, trigger, chanindx, chanstr, redischannel, thread
+    global monitor, duration_scale, duration_offset, serialdevice, s, lock, trigger, chanindx, chanstr, redischannel, this, dispatcher
 
     # loop over the control voltages
     for chanindx in range(1, 5):
@@ -263,13 +250,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher
     monitor.success("Closing threads")
-    for thread in trigger:
-        thread.stop()
-    r.publish('OUTPUTCVGATE_UNBLOCK', 1)
-    for thread in trigger:
-            thread.join()
+    dispatcher.stop()
     sys.exit()
 
 
@@ -21,6 +21,7 @@
 
 import configparser
 import argparse
+import numpy as np
 import os
 import redis
 import sys
@@ -55,9 +56,9 @@ def sendframe(s, dmxframe):
     # See http://agreeabledisagreements.blogspot.nl/2012/10/a-beginners-guide-to-dmx512-in-python.html
     # See https://www.enttec.com/docs/dmx_usb_pro_api_spec.pdf
     # See https://github.com/itsb/DmxPy
-    packet = [0x7E, 0x06, ((len(dmxframe) + 1) >> 0) & 0xFF, ((len(dmxframe) + 1) >> 8) & 0xFF, 0x00] + dmxframe + [0xE7]
+    packet = bytearray([0x7E, 0x06, ((len(dmxframe) + 1) >> 0) & 0xFF, ((len(dmxframe) + 1) >> 8) & 0xFF, 0x00]) + bytes(dmxframe) + bytearray([0xE7])
     monitor.debug(packet)
-    s.write(bytearray(packet))
+    s.write(packet)
 
 
 def _setup():
@@ -92,7 +93,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, dmxframe, prevtime, START_VAL, END_VAL, TX_DMX_PACKET, FRAME_PAD
+    global monitor, debug, serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, items, dmxframe, prevtime, START_VAL, END_VAL, TX_DMX_PACKET, FRAME_PAD
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -124,8 +125,15 @@ def _start():
     dmxsize = max(dmxsize, 16)
     monitor.info("universe size = %d" % dmxsize)
 
+    # determine the channels that are specified, these are 1-offset in the ini file
+    chanindx = np.array([i for i in range(dmxsize) if "channel%03d" % (i + 1) in chanlist], dtype=int)
+    chanstr = ["channel%03d" % (i + 1) for i in chanindx]
+
+    # the input, scale and offset of all channels are retrieved from Redis in a single round trip
+    items = [('input', c) for c in chanstr] + [('scale', c) for c in chanstr] + [('offset', c) for c in chanstr]
+
     # make an empty frame
-    dmxframe = [0] * dmxsize
+    dmxframe = np.zeros(dmxsize, dtype=np.uint8)
     # blank out
     sendframe(s, dmxframe)
 
@@ -142,35 +150,28 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, debug, serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, dmxframe, prevtime
-    global update, chanval, scale, offset
-
-    update = False
-
-    # loop over the control values, these are 1-offset in the ini file
-    for chanindx in range(0, dmxsize):
-        chanstr = "channel%03d" % (chanindx + 1)
-        # this returns None when the channel is not present
-        chanval = patch.getfloat('input', chanstr)
-
-        if chanval == None:
-            # the value is not present in Redis, skip it
-            continue
-
-        # the scale and offset options are channel specific
-        scale = patch.getfloat('scale', chanstr, default=255)
-        offset = patch.getfloat('offset', chanstr, default=0)
-        # apply the scale and offset
-        chanval = EEGsynth.rescale(chanval, slope=scale, offset=offset)
-        # ensure that it is within limits
-        chanval = EEGsynth.limit(chanval, lo=0, hi=255)
-        chanval = int(chanval)
-
-        # only update if the value has changed
-        if dmxframe[chanindx] != chanval:
-            monitor.info("DMX channel%03d = %g" % (chanindx, chanval))
-            dmxframe[chanindx] = chanval
-            update = True
+    global monitor, debug, serialdevice, s, dmxsize, chanlist, chanvals, chanindx, chanstr, items, dmxframe, prevtime
+    global update, chanval, scale, offset, present, indx, changed, i, val
+
+    # this returns NaN for the channels that are not present
+    chanval, scale, offset = np.array(patch.getfloats(items), dtype=float).reshape(3, -1)
+
+    # the scale and offset options are channel specific
+    scale[np.isnan(scale)] = 255
+    offset[np.isnan(offset)] = 0
+
+    # the channels that are not present in Redis are skipped
+    present = ~np.isnan(chanval)
+    indx = chanindx[present]
+    # apply the scale and offset, and ensure that it is within limits
+    chanval = np.clip(scale[present] * chanval[present] + offset[present], 0, 255).astype(np.uint8)
+
+    # only update if the value has changed
+    changed = dmxframe[indx] != chanval
+    for i, val in zip(indx[changed], chanval[changed]):
+        monitor.info("DMX channel%03d = %g" % (i, val))
+    dmxframe[indx] = chanval
+    update = np.any(changed)
 
     if update:
         sendframe(s, dmxframe)
@@ -61,44 +61,29 @@ def SetGPIO(gpio, val=1):
         monitor.debug(str(gpio) + " " + str(pin[gpio]) + " " + str(val))
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel, gpio, duration):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.gpio = gpio
         self.duration = duration
-        self.running = True
-
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        pubsub = r.pubsub()
-        # this message unblocks the Redis listen command
-        pubsub.subscribe('OUTPUTGPIO_UNBLOCK')
-        # this message triggers the event
-        pubsub.subscribe(self.redischannel)
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    # the scale and offset options are channel specific and can be changed on the fly
-                    scale = patch.getfloat('scale', self.gpio, default=100)
-                    offset = patch.getfloat('offset', self.gpio, default=0)
-                    # switch to the PWM value specified in the event
-                    val = float(item['data'])
-                    val = EEGsynth.rescale(val, slope=scale, offset=offset)
-                    val = int(val)
-                    SetGPIO(self.gpio, val)
-                    if self.duration != None:
-                        # schedule a timer to switch it off after the specified duration
-                        duration = patch.getfloat('duration', self.gpio)
-                        duration = EEGsynth.rescale(duration, slope=scale_duration, offset=offset_duration)
-                        # some minimal time is needed for the delay
-                        duration = EEGsynth.limit(duration, 0.05, float('Inf'))
-                        t = threading.Timer(duration, SetGPIO, args=[self.gpio, 0])
-                        t.start()
+
+    def __call__(self, item):
+        # the scale and offset options are channel specific and can be changed on the fly
+        scale = patch.getfloat('scale', self.gpio, default=100)
+        offset = patch.getfloat('offset', self.gpio, default=0)
+        # switch to the PWM value specified in the event
+        val = float(item['data'])
+        val = EEGsynth.rescale(val, slope=scale, offset=offset)
+        val = int(val)
+        SetGPIO(self.gpio, val)
+        if self.duration != None:
+            # schedule a timer to switch it off after the specified duration
+            duration = patch.getfloat('duration', self.gpio)
+            duration = EEGsynth.rescale(duration, slope=scale_duration, offset=offset_duration)
+            # some minimal time is needed for the delay
+            duration = EEGsynth.limit(duration, 0.05, float('Inf'))
+            t = threading.Timer(duration, SetGPIO, args=[self.gpio, 0])
+            t.start()
 
 
 def _setup():
@@ -133,7 +118,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, pin, debug, delay, scale_duration, offset_duration, lock, trigger
+    global monitor, pin, debug, delay, scale_duration, offset_duration, lock, trigger, this, dispatcher
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -181,17 +166,19 @@ def _start():
         # control values are only relevant when different from the previous value
         previous_val[gpio] = None
 
-    # create the threads that deal with the triggers
+    # configure the triggers
     trigger = []
     for gpio, channel in config.items('trigger'):
         wiringpi.pinMode(pin[gpio], 1)
         duration = patch.getstring('duration', gpio)
-        trigger.append(TriggerThread(channel, gpio, duration))
+        trigger.append(Trigger(channel, gpio, duration))
         monitor.info("trigger " + channel + " " + gpio)
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -239,13 +226,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    r.publish('OUTPUTGPIO_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
     sys.exit()
 
 
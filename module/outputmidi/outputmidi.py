@@ -152,33 +152,21 @@ def sendMidi(name, code, val):
     outputport.send(msg)
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel, name, code):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.name = name
         self.code = code
-        self.running = True
-    def stop(self):
-        self.running = False
-    def run(self):
-        pubsub = r.pubsub()
-        pubsub.subscribe('OUTPUTMIDI_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)     # this message contains the value of interest
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel']==self.redischannel:
-                    monitor.trace(item)
-                    # map the Redis values to MIDI values
-                    val = float(item['data'])
-                    # the scale and offset options are channel specific and can be changed on the fly
-                    scale = patch.getfloat('scale', self.name, default=127)
-                    offset = patch.getfloat('offset', self.name, default=0)
-                    val = EEGsynth.rescale(val, slope=scale, offset=offset)
-                    with lock:
-                        sendMidi(self.name, self.code, val)
+    def __call__(self, item):
+        monitor.trace(item)
+        # map the Redis values to MIDI values
+        val = float(item['data'])
+        # the scale and offset options are channel specific and can be changed on the fly
+        scale = patch.getfloat('scale', self.name, default=127)
+        offset = patch.getfloat('offset', self.name, default=0)
+        val = EEGsynth.rescale(val, slope=scale, offset=offset)
+        with lock:
+            sendMidi(self.name, self.code, val)
 
 
 def _setup():
@@ -213,7 +201,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global debug, mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, thread, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
+    global debug, mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note, dispatcher
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general','debug'))
@@ -275,14 +263,16 @@ def _start():
     trigger = []
     for name, code in zip(trigger_name, trigger_code):
         if config.has_option('trigger', name):
-            # start the background thread that deals with this note
-            this = TriggerThread(patch.getstring('trigger', name), name, code)
+            # configure the trigger that deals with this note
+            this = Trigger(patch.getstring('trigger', name), name, code)
             trigger.append(this)
             monitor.debug(name + ' trigger configured')
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     control_name = []
     control_code = []
@@ -312,7 +302,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global debug, mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, thread, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note
+    global debug, mididevice, port, previous_note, trigger_name, trigger_code, code, trigger, this, control_name, control_code, previous_val, duration_note, lock, midichannel, monitor, monophonic, offset_duration, offset_velocity, outputport, scale_duration, scale_velocity, velocity_note, dispatcher
 
     UpdateParameters()
 
@@ -346,14 +336,10 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher
 
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    r.publish('OUTPUTMIDI_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
 
 
 if __name__ == '__main__':
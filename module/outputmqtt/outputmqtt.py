@@ -51,37 +51,24 @@ sys.path.insert(0, os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel, name, mqtttopic):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.name = name
         self.mqtttopic = mqtttopic
-        self.running = True
-
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        pubsub = r.pubsub()
-        pubsub.subscribe('OUTPUTMQTT_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)     # this message contains the value of interest
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel'] == self.redischannel:
-                    # map the Redis values to MQTT values
-                    val = float(item['data'])
-                    # the scale and offset options are channel specific
-                    scale = patch.getfloat('scale', self.name, default=1)
-                    offset = patch.getfloat('offset', self.name, default=0)
-                    # apply the scale and offset
-                    val = EEGsynth.rescale(val, slope=scale, offset=offset)
-
-                    monitor.update(self.mqtttopic, val)
-                    with lock:
-                        client.publish(self.mqtttopic, payload=val, qos=0, retain=False)
+
+    def __call__(self, item):
+        # map the Redis values to MQTT values
+        val = float(item['data'])
+        # the scale and offset options are channel specific
+        scale = patch.getfloat('scale', self.name, default=1)
+        offset = patch.getfloat('offset', self.name, default=0)
+        # apply the scale and offset
+        val = EEGsynth.rescale(val, slope=scale, offset=offset)
+
+        monitor.update(self.mqtttopic, val)
+        with lock:
+            client.publish(self.mqtttopic, payload=val, qos=0, retain=False)
 
 
 # The callback for when the client receives a CONNACK response from the broker.
@@ -136,7 +123,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, list_input, list_output, list1, list2, list3, i, j, lock, trigger, key1, key2, key3, this, thread, client
+    global monitor, debug, list_input, list_output, list1, list2, list3, i, j, lock, trigger, key1, key2, key3, this, client, dispatcher
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -164,13 +151,15 @@ def _start():
     # each of the Redis messages is mapped onto a different MQTT topic
     trigger = []
     for key1, key2, key3 in zip(list1, list2, list3):
-        this = TriggerThread(key2, key1, key3)
+        this = Trigger(key2, key1, key3)
         trigger.append(this)
         monitor.debug(key1 + " trigger configured")
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     # make the connection with the MQTT broker
     try:
@@ -206,13 +195,9 @@ def _loop_forever():
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    r.publish('OUTPUTMQTT_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
     sys.exit()
 
 
@@ -38,7 +38,7 @@ if sys.version_info < (3,5):
         print('Warning: OSC is required for the outputosc module, please install it with "pip install OSC"')
 else:
     try:
-        from pythonosc import udp_client
+        from pythonosc import udp_client, osc_bundle_builder, osc_message_builder
         use_old_version = False
     except ModuleNotFoundError:
         # give a warning, not an error, so that eegsynth.py does not fail as a whole
@@ -66,41 +66,28 @@ sys.path.insert(0, os.path.join(path,'../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel, name, osctopic):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
         self.name = name
         self.osctopic = osctopic
-        self.running = True
-    def stop(self):
-        self.running = False
-    def run(self):
-        pubsub = r.pubsub()
-        pubsub.subscribe('OUTPUTOSC_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(self.redischannel)     # this message contains the value of interest
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                if item['channel']==self.redischannel:
-                    # map the Redis values to OSC values
-                    val = float(item['data'])
-                    # the scale and offset options are channel specific
-                    scale  = patch.getfloat('scale', self.name, default=1)
-                    offset = patch.getfloat('offset', self.name, default=0)
-                    # apply the scale and offset
-                    val = EEGsynth.rescale(val, slope=scale, offset=offset)
-
-                    monitor.update(self.osctopic, val)
-                    with lock:
-                        # send it as a string with a space as separator
-                        if use_old_version:
-                            msg = OSC.OSCMessage(self.osctopic)
-                            msg.append(val)
-                            s.send(msg)
-                        else:
-                            s.send_message(self.osctopic, val)
+    def __call__(self, item):
+        # map the Redis values to OSC values
+        val = float(item['data'])
+        # the scale and offset options are channel specific, they are cached in the main loop
+        val = EEGsynth.rescale(val, slope=scale[self.name], offset=offset[self.name])
+
+        monitor.update(self.osctopic, val)
+        with lock:
+            if bundle > 0:
+                # only the latest value for each topic is sent in the next bundle
+                pending[self.osctopic] = val
+            elif use_old_version:
+                msg = OSC.OSCMessage(self.osctopic)
+                msg.append(val)
+                s.send(msg)
+            else:
+                s.send_message(self.osctopic, val)
 
 
 def _setup():
@@ -135,13 +122,15 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, s, list_input, list_output, list1, list2, list3, i, j, lock, trigger, key1, key2, key3, this, thread
+    global monitor, debug, s, list_input, list_output, list1, list2, list3, i, j, lock, trigger, key1, key2, key3, this, dispatcher
+    global bundle, pending, pacer, scale, offset
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general','debug'))
 
     # get the options from the configuration file
     debug = patch.getint('general', 'debug')
+    bundle = patch.getfloat('osc', 'bundle', default=0)
 
     try:
         if use_old_version:
@@ -170,16 +159,30 @@ def _start():
     # this is to prevent two messages from being sent at the same time
     lock = threading.Lock()
 
+    # the values that are to be sent in the next bundle, indexed by OSC topic
+    pending = {}
+    if bundle > 0:
+        # the bundles are sent with a fixed frame rate
+        pacer = EEGsynth.pacer(1. / bundle, maxlag=1)
+    else:
+        pacer = None
+
+    # the scale and offset for all keys are retrieved at once and cached
+    scale  = dict(zip(list1, patch.getfloats([('scale', key1) for key1 in list1], default=1)))
+    offset = dict(zip(list1, patch.getfloats([('offset', key1) for key1 in list1], default=0)))
+
     # each of the Redis messages is mapped onto a different OSC topic
     trigger = []
     for key1, key2, key3 in zip(list1, list2, list3):
-        this = TriggerThread(key2, key1, key3)
+        this = Trigger(key2, key1, key3)
         trigger.append(this)
         monitor.debug(key1 + ' trigger configured')
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -189,29 +192,57 @@ def _start():
 def _loop_once():
     '''Run the main loop once
     '''
-    pass
+    global monitor, patch, s, list1, lock, bundle, pending, scale, offset
+    global values, topic, val, msg, builder
+
+    # update the cached scale and offset
+    scale  = dict(zip(list1, patch.getfloats([('scale', key1) for key1 in list1], default=1)))
+    offset = dict(zip(list1, patch.getfloats([('offset', key1) for key1 in list1], default=0)))
+
+    if bundle > 0:
+        with lock:
+            values = pending
+            pending = {}
+            if len(values):
+                # send all values that were updated in this frame as a single timestamped bundle
+                if use_old_version:
+                    builder = OSC.OSCBundle()
+                    builder.setTimeTag(time.time())
+                    for topic, val in values.items():
+                        msg = OSC.OSCMessage(topic)
+                        msg.append(val)
+                        builder.append(msg)
+                    s.send(builder)
+                else:
+                    builder = osc_bundle_builder.OscBundleBuilder(time.time())
+                    for topic, val in values.items():
+                        msg = osc_message_builder.OscMessageBuilder(address=topic)
+                        msg.add_arg(val)
+                        builder.add_content(msg.build())
+                    s.send(builder.build())
+                monitor.debug('sent bundle with %d values' % len(values))
 
 
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, patch
+    global monitor, patch, bundle, pacer
     while True:
         monitor.loop()
         _loop_once()
-        time.sleep(patch.getfloat('general', 'delay'))
+        if bundle > 0:
+            pacer.update(1)
+            pacer.wait()
+        else:
+            time.sleep(patch.getfloat('general', 'delay'))
 
 
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, trigger, r
+    global monitor, dispatcher
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    r.publish('OUTPUTOSC_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
     sys.exit()
 
 
@@ -82,7 +82,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block
+    global monitor, debug, filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block, recordsize, record, D, pacer
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -121,12 +121,21 @@ def _start():
     for s, z in zip(channels, channelz):
         monitor.info("Writing channel " + s + " as control value " + z)
 
+    # the data is decoded one record at a time for all channels
+    chanindx = list(range(f.getNSignals()))
+    recordsize = f.chan_info['n_samps'][0]
+    record = -1
+    D = None
+
     # this should write data in one-sample blocks
     blocksize = 1
     begsample = 0
     endsample = blocksize - 1
     block = 0
 
+    # this keeps the real time speed
+    pacer = EEGsynth.pacer(fSample)
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -137,8 +146,8 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, debug, filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block
-    global indx, val, stepsize, elapsed, naptime
+    global monitor, debug, filename, f, chanindx, channels, channelz, fSample, nSamples, replace, i, s, z, blocksize, begsample, endsample, block, recordsize, record, D, pacer
+    global val
 
     if endsample > nSamples - 1:
         monitor.info("End of file reached, jumping back to start")
@@ -155,21 +164,28 @@ def _loop_once():
     if not patch.getint('playback', 'play', default=1):
         monitor.info("Stopped")
         time.sleep(0.1)
+        pacer.reset()
         return
 
     if patch.getint('playback', 'pause', default=0):
         monitor.info("Paused")
         time.sleep(0.1)
+        pacer.reset()
         return
 
     monitor.debug("Playing control value", block, 'from', begsample, 'to', endsample)
 
-    for indx in range(len(channelz)):
-        # read one sample for a single channel
-        val = float(f.readSamples(indx, begsample, endsample))
-        patch.setvalue(channelz[indx], val)
+    if begsample // recordsize != record:
+        # read the record containing this sample for all channels
+        record = begsample // recordsize
+        D = f.readSamples(chanindx, record * recordsize, min((record + 1) * recordsize, nSamples) - 1)
 
-    stepsize = blocksize / (fSample * patch.getfloat('playback', 'speed'))
+    # write the values of all channels to Redis in a single round trip
+    val = D[begsample - record * recordsize].tolist()
+    patch.setvalues(list(zip(channelz, val)))
+
+    # the next sample is due after the duration of this sample at the current speed
+    pacer.update(blocksize, patch.getfloat('playback', 'speed'))
     begsample += blocksize
     endsample += blocksize
     block += 1
@@ -182,19 +198,14 @@ def _loop_once():
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepsize
+    global monitor, pacer
     while True:
-        # measure the time to correct for the slip
-        start = time.time()
-
         monitor.loop()
         _loop_once()
 
-        elapsed = time.time() - start
-        naptime = stepsize - elapsed
-        if naptime > 0:
-            # this approximates the real time streaming speed
-            time.sleep(naptime)
+        # sleep until the next sample is due, this does not accumulate the slip
+        lag = pacer.wait()
+        monitor.debug("lag = %.3f seconds" % lag)
 
 
 def _stop():
@@ -53,6 +53,33 @@ import FieldTrip
 import EDF
 
 
+def wavoffset(filename):
+    '''Determine where the data chunk starts in a WAV file
+    '''
+    with open(filename, 'rb') as fid:
+        # skip the RIFF header and loop over the chunks
+        fid.seek(12)
+        while True:
+            chunk = fid.read(8)
+            if len(chunk) < 8:
+                raise RuntimeError('cannot find the data in ' + filename)
+            chunkid, chunksize = struct.unpack('<4sI', chunk)
+            if chunkid == b'data':
+                return fid.tell()
+            # chunks are aligned on two bytes
+            fid.seek(chunksize + chunksize % 2, os.SEEK_CUR)
+
+
+def readahead(begsample, endsample):
+    '''Advise the operating system to read this part of the file into memory
+    '''
+    global fd, dataoffset, recordsize, recordlength
+    if hasattr(os, 'posix_fadvise') and endsample >= begsample:
+        begbyte = dataoffset + (begsample // recordlength) * recordsize
+        endbyte = dataoffset + (endsample // recordlength + 1) * recordsize
+        os.posix_fadvise(fd, begbyte, endbyte - begbyte, os.POSIX_FADV_WILLNEED)
+
+
 def _setup():
     '''Initialize the module
     This adds a set of global variables
@@ -86,6 +113,7 @@ def _start():
     '''
     global parser, args, config, r, response, patch, name
     global monitor, filename, fileformat, ext, ft_host, ft_port, ft_output, H, MININT8, MAXINT8, MININT16, MAXINT16, MININT32, MAXINT32, f, chanindx, labels, A, blocksize, begsample, endsample, block
+    global physical_min, physical_max, resolution, dtype, calibrate, offset, dataoffset, recordsize, recordlength, fd, prefetch, pacer
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -135,12 +163,11 @@ def _start():
         H.dataType = FieldTrip.DATATYPE_FLOAT32
         # the channel labels will be written to the buffer
         labels = f.getSignalTextLabels()
-        # read all the data from the file
-        A = np.ndarray(shape=(H.nSamples, H.nChannels), dtype=np.float32)
-        for chanindx in range(H.nChannels):
-            monitor.info('reading channel ' + str(chanindx))
-            A[:, chanindx] = f.readSignal(chanindx)
-        f.close()
+        # the file remains open, the data records are memory-mapped and read while playing
+        chanindx = list(range(H.nChannels))
+        dataoffset = f.meas_info['data_offset']
+        recordsize = f.records.dtype.itemsize
+        recordlength = f.chan_info['n_samps'][0]
 
     elif fileformat == 'wav':
         try:
@@ -162,21 +189,29 @@ def _start():
         H.dataType = FieldTrip.DATATYPE_FLOAT32
         # there are no channel labels
         labels = None
-        # read all the data from the file
-        x = f.readframes(f.getnframes() * f.getnchannels())
         f.close()
-        # convert and calibrate
-        if resolution == 2:
-            x = struct.unpack_from('%dh' % f.getnframes() * f.getnchannels(), x)
-            x = np.asarray(x).astype(np.float32).reshape(f.getnframes(), f.getnchannels())
-            y = x / float(MAXINT16)
+        # the scaling and offset are applied to each block while playing
+        if resolution == 1:
+            dtype = np.uint8
+            calibrate = 1. / float(MAXINT8)
+            offset = -128. / float(MAXINT8)
+        elif resolution == 2:
+            dtype = '<i2'
+            calibrate = 1. / float(MAXINT16)
+            offset = 0.
         elif resolution == 4:
-            x = struct.unpack_from('%di' % f.getnframes() * f.getnchannels(), x)
-            x = np.asarray(x).astype(np.float32).reshape(f.getnframes(), f.getnchannels())
-            y = x / float(MAXINT32)
+            dtype = '<i4'
+            calibrate = 1. / float(MAXINT32)
+            offset = 0.
         else:
             raise NotImplementedError('unsupported resolution')
-        A = y * ((physical_max - physical_min) / 2)
+        calibrate *= (physical_max - physical_min) / 2
+        offset *= (physical_max - physical_min) / 2
+        # the samples of all channels are interleaved, the data is read while playing
+        dataoffset = wavoffset(filename)
+        recordsize = H.nChannels * resolution
+        recordlength = 1
+        A = np.memmap(filename, dtype=dtype, mode='r', offset=dataoffset, shape=(H.nSamples, H.nChannels))
 
     else:
         raise NotImplementedError('unsupported file format')
@@ -189,10 +224,17 @@ def _start():
     ft_output.putHeader(H.nChannels, H.fSample, H.dataType, labels=labels)
 
     blocksize = int(patch.getfloat('playback', 'blocksize') * H.fSample)
+    # the next blocks are read from disk in advance
+    prefetch = patch.getint('playback', 'readahead', default=4) * blocksize
+    fd = os.open(filename, os.O_RDONLY)
+    readahead(0, prefetch - 1)
     begsample = 0
     endsample = blocksize - 1
     block = 0
 
+    # this keeps the real time streaming speed
+    pacer = EEGsynth.pacer(H.fSample)
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -203,8 +245,8 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, H, A, ft_output, blocksize, begsample, endsample, block
-    global D, stepsize
+    global monitor, H, A, ft_output, blocksize, begsample, endsample, block, fileformat, f, chanindx, calibrate, offset, prefetch, pacer
+    global D
 
     if endsample > H.nSamples - 1:
         monitor.info('End of file reached, jumping back to start')
@@ -221,26 +263,35 @@ def _loop_once():
     if not patch.getint('playback', 'play', default=1):
         monitor.info('Stopped')
         time.sleep(0.1)
+        pacer.reset()
         return
 
     if patch.getint('playback', 'pause', default=0):
         monitor.info('Paused')
         time.sleep(0.1)
+        pacer.reset()
         return
 
     monitor.info('Playing block ' + str(block) + ' from ' + str(begsample) + ' to ' + str(endsample))
 
-    # copy the selected samples from the in-memory data
-    D = A[begsample:endsample + 1, :]
+    # read and calibrate the selected samples from the file
+    if fileformat == 'edf':
+        D = f.readSamples(chanindx, begsample, endsample)
+    else:
+        D = (A[begsample:endsample + 1, :] * calibrate + offset).astype(np.float32)
 
     # write the data to the output buffer
     ft_output.putData(D)
 
-    stepsize = blocksize / (H.fSample * patch.getfloat('playback', 'speed'))
+    # the next block is due after the duration of this block at the current speed
+    pacer.update(blocksize, patch.getfloat('playback', 'speed'))
     begsample += blocksize
     endsample += blocksize
     block += 1
 
+    # start reading the upcoming part of the file from disk
+    readahead(begsample, min(begsample + prefetch - 1, H.nSamples - 1))
+
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
         print('LOCALS: ' + ', '.join(locals().keys()))
@@ -249,24 +300,22 @@ def _loop_once():
 def _loop_forever():
     '''Run the main loop forever
     '''
-    global monitor, stepsize
+    global monitor, pacer
     while True:
-        # measure the time to correct for the slip
-        start = time.time()
-
         monitor.loop()
         _loop_once()
 
-        elapsed = time.time() - start
-        naptime = stepsize - elapsed
-        if naptime > 0:
-            # this approximates the real time streaming speed
-            time.sleep(naptime)
+        # sleep until the next block is due, this does not accumulate the slip
+        lag = pacer.wait()
+        monitor.debug('lag = %.3f seconds' % lag)
 
 
 def _stop():
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
+    global fd
+    # the file descriptor was only opened to advise the operating system on reading ahead
+    os.close(fd)
     sys.exit()
 
 
@@ -98,7 +98,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input, name
-    global channels, winx, winy, winwidth, winheight, window, clipsize, stepsize, lrate, ylim, timeout, hdr_input, start, filtorder, filter, notch, app, win, timeplot, curve, curvemax, plotnr, channr, timer, begsample, endsample
+    global channels, winx, winy, winwidth, winheight, window, clipsize, stepsize, lrate, ylim, timeout, hdr_input, start, filtorder, filter, notch, app, win, timeplot, curve, curvemax, plotnr, channr, timer, begsample, endsample, ft_window
 
     # read variables from ini/redis
     channels    = patch.getint('arguments', 'channels', multiple=True)
@@ -147,6 +147,9 @@ def _start():
     # notch filtering is optional
     notch = patch.getfloat('arguments', 'notch', default=np.nan)
 
+    # this keeps the most recent samples, only the new ones are read on every update
+    ft_window = FieldTrip.SlidingWindow(ft_input, window)
+
     # wait until there is enough data
     begsample = -1
     while begsample < 0:
@@ -194,7 +197,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input
-    global channels, winx, winy, winwidth, winheight, window, clipsize, stepsize, lrate, ylim, timeout, hdr_input, start, filtorder, filter, notch, app, win, timeplot, curve, curvemax, plotnr, channr, timer, begsample, endsample
+    global channels, winx, winy, winwidth, winheight, window, clipsize, stepsize, lrate, ylim, timeout, hdr_input, start, filtorder, filter, notch, app, win, timeplot, curve, curvemax, plotnr, channr, timer, begsample, endsample, ft_window
     global dat, timeaxis
 
     monitor.loop()
@@ -214,7 +217,8 @@ def _loop_once():
 
     monitor.info("reading from sample %d to %d" % (begsample, endsample))
 
-    dat = ft_input.getData([begsample, endsample]).astype(np.double)
+    # copy the data, since the local buffer is reused on the next update
+    dat = ft_window.update(hdr_input).copy()
 
     # demean the data before filtering to reduce edge artefacts and to center timecourse
     if patch.getint('arguments', 'demean', default=1):
@@ -189,17 +189,8 @@ def _loop_once():
 
     monitor.loop()
 
-    # determine when we start polling for available data
-    start = time.time()
-
-    while endsample>hdr_input.nSamples-1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
-        if (hdr_input.nSamples-1)<(endsample-window):
-            raise RuntimeError("buffer reset detected")
-        if (time.time()-start)>timeout:
-            raise RuntimeError("timeout while waiting for data")
+    # wait until there is enough data
+    hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(endsample, timeout, begsample)
 
     # determine the start of the actual processing
     start = time.time()
@@ -52,6 +52,21 @@ import EEGsynth
 import EDF
 
 
+def closefile():
+    '''Write the samples that remain in the incomplete block and close the file
+    '''
+    global MININT32, MAXINT32, fileformat, f, blocksize, sample, physical_min, physical_max, D, z
+    if (sample % blocksize) > 0:
+        if fileformat == 'edf':
+            # an EDF file can only contain complete blocks, the last block is padded with the last sample
+            D[(sample % blocksize):] = D[(sample % blocksize) - 1]
+            f.writeBlock(np.transpose(D))
+        elif fileformat == 'wav':
+            z = D[0:(sample % blocksize)] / ((physical_max - physical_min) / 2.) * ((float(MAXINT32) - float(MININT32)) / 2.)
+            f.writeframesraw(np.clip(z, MININT32, MAXINT32).astype('<i4').tobytes())
+    f.close()
+
+
 def _setup():
     '''Initialize the module
     This adds a set of global variables
@@ -120,14 +135,14 @@ def _loop_once():
     '''
     global parser, args, config, r, response, patch
     global monitor, MININT16, MAXINT16, MININT32, MAXINT32, debug, delay, filename, fileformat, filenumber, recording, adjust
-    global start, fname, f, ext, blocksize, synchronize, channels, channelz, nchans, sample, replace, i, s, z, physical_min, physical_max, meas_info, chan_info, recstart, D, chan, xval, elapsed
+    global start, fname, f, ext, blocksize, synchronize, channels, channelz, nchans, sample, replace, i, s, z, physical_min, physical_max, meas_info, chan_info, recstart, D, xval, key, elapsed
 
     # measure the time to correct for the slip
     start = time.time()
 
     if recording and not patch.getint('recording', 'record'):
         monitor.info("Recording disabled - closing " + fname)
-        f.close()
+        closefile()
         recording = False
         return
 
@@ -142,14 +157,15 @@ def _loop_once():
         if len(ext) == 0:
             ext = '.' + fileformat
         fname = name + '_' + datetime.datetime.now().strftime("%Y.%m.%d_%H.%M.%S") + ext
-        # the blocksize is always 1
-        blocksize = 1
+        # the samples are written to file in blocks, the default is to write each sample
+        blocksize = max(1, int(round(patch.getfloat('recording', 'blocksize', default=delay) / delay)))
+        # the synchronization message is sent after a whole number of blocks
         synchronize = int(patch.getfloat('recording', 'synchronize') / delay)
-        assert (synchronize % blocksize) == 0, "synchronize should be multiple of blocksize"
+        synchronize = max(1, int(round(synchronize / blocksize))) * blocksize
 
-        # get the details from Redis
-        channels = sorted(r.keys('*'))
-        channelz = sorted(r.keys('*'))
+        # get the details from Redis, SCAN does not block the server like KEYS
+        channels = sorted(set(r.scan_iter(match=patch.getstring('recording', 'channels', default='*'), count=1000)))
+        channelz = list(channels)
         nchans = len(channels)
         # this is to keep track of the number of samples written so far
         sample = 0
@@ -172,7 +188,7 @@ def _loop_once():
             # construct the header
             meas_info = {}
             chan_info = {}
-            meas_info['record_length'] = delay
+            meas_info['record_length'] = delay * blocksize
             meas_info['nchan'] = nchans
             recstart = datetime.datetime.now()
             meas_info['year'] = recstart.year
@@ -186,7 +202,7 @@ def _loop_once():
             chan_info['digital_min'] = nchans * [MININT16]
             chan_info['digital_max'] = nchans * [MAXINT16]
             chan_info['ch_names'] = channelz
-            chan_info['n_samps'] = nchans * [1]
+            chan_info['n_samps'] = nchans * [blocksize]
             f = EDF.EDFWriter(fname)
             f.writeHeader((meas_info, chan_info))
         elif fileformat == 'wav':
@@ -198,36 +214,36 @@ def _loop_once():
         else:
             raise NotImplementedError('unsupported file format')
 
+        # the samples are collected in memory until the block is complete
+        D = np.zeros((blocksize, nchans))
+
     if recording:
-        D = []
-        for chan in channels:
-            xval = r.get(chan)
+        # get the values of all channels in a single round trip
+        xval = r.mget(channels) if nchans else []
+        for i, s in enumerate(xval):
             try:
-                xval = float(xval)
-            except ValueError:
-                xval = 0.
-            xval = EEGsynth.limit(xval, physical_min, physical_max)
-            D.append([xval])
+                xval[i] = float(s)
+            except (TypeError, ValueError):
+                xval[i] = 0.
+        D[sample % blocksize] = np.clip(xval, physical_min, physical_max)
         sample += 1
 
         if (sample % synchronize) == 0:
             key = "{}.synchronize".format(patch.getstring('prefix', 'synchronize'))
             patch.setvalue(key, sample)
 
-        monitor.info("Writing sample " + str(sample) + " as " + str(np.shape(D)))
-
-        if fileformat == 'edf':
-            f.writeBlock(D)
-        elif fileformat == 'wav':
-            D = np.asarray(D)
-            for x in D:
+        if (sample % blocksize) == 0:
+            monitor.info("Writing sample " + str(sample - blocksize + 1) + " to " + str(sample) + " as " + str(np.shape(D)))
+            if fileformat == 'edf':
+                f.writeBlock(np.transpose(D))
+            elif fileformat == 'wav':
                 # scale the floating point values between -1 and 1
-                y = x / ((physical_max - physical_min) / 2.)
+                z = D / ((physical_max - physical_min) / 2.)
                 # scale the floating point values between MININT32 and MAXINT32
-                y = y * ((float(MAXINT32) - float(MININT32)) / 2.)
-                # convert them to packed binary data
-                z = "".join((wave.struct.pack('i', item) for item in y))
-                f.writeframesraw(z)
+                z = z * ((float(MAXINT32) - float(MININT32)) / 2.)
+                z = np.clip(z, MININT32, MAXINT32)
+                # convert them to little-endian 32-bit integers, the samples of all channels are interleaved
+                f.writeframesraw(z.astype('<i4').tobytes())
 
         time.sleep(adjust * delay)
 
@@ -253,6 +269,11 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
+    global monitor, recording, fname
+    if recording:
+        monitor.info("Closing " + fname)
+        closefile()
+        recording = False
     sys.exit()
 
 
@@ -28,7 +28,6 @@ import redis
 import sys
 import time
 import wave
-import struct
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -245,15 +244,13 @@ def _loop_once():
             # the scaling is done in the EDF writer
             f.writeBlock(np.transpose(dat))
         elif fileformat == 'wav':
-            for sample in range(len(dat)):
-                x = dat[sample, :]
-                # scale the floating point values between -1 and 1
-                y = x / ((physical_max - physical_min) / 2)
-                # scale the floating point values between MININT32 and MAXINT32
-                y = y * ((float(MAXINT32) - float(MININT32)) / 2)
-                # convert them to packed binary data
-                z = [int(item) for item in y]
-                f.writeframesraw(wave.struct.pack('i' * len(z), *z))
+            # scale the floating point values between -1 and 1
+            dat = dat / ((physical_max - physical_min) / 2)
+            # scale the floating point values between MININT32 and MAXINT32
+            dat = dat * ((float(MAXINT32) - float(MININT32)) / 2)
+            dat = np.clip(dat, MININT32, MAXINT32)
+            # convert them to little-endian 32-bit integers, the samples of all channels are interleaved
+            f.writeframesraw(dat.astype('<i4').tobytes())
         begsample += blocksize
         endsample += blocksize
 
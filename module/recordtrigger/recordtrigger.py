@@ -51,42 +51,28 @@ sys.path.insert(0, os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
+class Trigger():
     def __init__(self, redischannel):
-        threading.Thread.__init__(self)
         self.redischannel = redischannel
-        self.running = True
 
-    def stop(self):
-        self.running = False
-
-    def run(self):
+    def __call__(self, item):
         global r, monitor, lock
-        pubsub = r.pubsub()
-        pubsub.subscribe('RECORDTRIGGER_UNBLOCK')  # this message unblocks the Redis listen command
-        pubsub.subscribe(self.redischannel)        # this message triggers the event
-        while self.running:
-            for item in pubsub.listen():
-                timestamp = datetime.datetime.now().isoformat()
-                if not self.running or not item['type'] == 'message':
-                    print(item["type"])
-                    break
-                if item['channel'] == self.redischannel:
-                    val = item["data"]
-                    # the trigger value should be saved
-                    if input_scale != None or input_offset != None:
-                        try:
-                            # convert it to a number and apply the scaling and the offset
-                            val = float(val)
-                            val = EEGsynth.rescale(val, slope=input_scale, offset=input_offset)
-                        except ValueError:
-                            # keep it as a string
-                            monitor.info(("cannot apply scaling, writing %s as string" % (self.redischannel)))
-                    if not f.closed:
-                        # write the value, it can be either a number or a string
-                        with lock:
-                            f.write("%s\t%s\t%s\n" % (self.redischannel, val, timestamp))
-                        monitor.info(("%s\t%s\t%s" % (self.redischannel, val, timestamp)))
+        timestamp = datetime.datetime.now().isoformat()
+        val = item["data"]
+        # the trigger value should be saved
+        if input_scale != None or input_offset != None:
+            try:
+                # convert it to a number and apply the scaling and the offset
+                val = float(val)
+                val = EEGsynth.rescale(val, slope=input_scale, offset=input_offset)
+            except ValueError:
+                # keep it as a string
+                monitor.info(("cannot apply scaling, writing %s as string" % (self.redischannel)))
+        if not f.closed:
+            # write the value, it can be either a number or a string
+            with lock:
+                f.write("%s\t%s\t%s\n" % (self.redischannel, val, timestamp))
+            monitor.info(("%s\t%s\t%s" % (self.redischannel, val, timestamp)))
 
 
 def _setup():
@@ -122,7 +108,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, delay, input_scale, input_offset, filename, fileformat, f, recording, filenumber, lock, trigger, item, thread
+    global monitor, debug, delay, input_scale, input_offset, filename, fileformat, f, recording, filenumber, lock, trigger, item, this, dispatcher
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -143,16 +129,18 @@ def _start():
     # this is to prevent two triggers from being saved at the same time
     lock = threading.Lock()
 
-    # create the background threads that deal with the triggers
+    # configure the triggers
     trigger = []
-    monitor.info("Setting up threads for each trigger")
+    monitor.info("Setting up each trigger")
     for item in config.items('trigger'):
-        trigger.append(TriggerThread(item[0]))
+        trigger.append(Trigger(item[0]))
         monitor.debug(item[0] + ' = OK')
 
-    # start the thread for each of the triggers
-    for thread in trigger:
-        thread.start()
+    # a single background thread dispatches the Redis messages to each of the triggers
+    dispatcher = EEGsynth.dispatcher(r)
+    for this in trigger:
+        dispatcher.register(this.redischannel, this)
+    dispatcher.start()
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -164,7 +152,7 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, debug, delay, input_scale, input_offset, filename, fileformat, f, recording, filenumber, lock, trigger, item, thread
+    global monitor, debug, delay, input_scale, input_offset, filename, fileformat, f, recording, filenumber, lock, trigger, item, this, dispatcher
     global fname, ext
 
     if recording and not patch.getint('recording', 'record'):
@@ -207,16 +195,12 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global f, monitor, trigger, r
+    global f, monitor, dispatcher
     if not f.closed:
         monitor.info('Closing file')
         f.close()
     monitor.success('Closing threads')
-    for thread in trigger:
-        thread.stop()
-    r.publish('RECORDTRIGGER_UNBLOCK', 1)
-    for thread in trigger:
-        thread.join()
+    dispatcher.stop()
     sys.exit()
 
 
@@ -21,7 +21,6 @@
 
 import configparser
 import argparse
-import math
 import numpy as np
 import os
 import redis
@@ -51,6 +50,59 @@ import EEGsynth
 import FieldTrip
 
 
+class RunningRMS():
+    """Class to compute the RMS value over one or multiple sliding windows. It keeps a
+    running sum of squares for each window, which is only updated with the new samples.
+
+    RunningRMS(windows, nchans) - the window lengths are specified in samples, at least one
+    RunningRMS.update(dat)      - add the new samples, which are specified as samples x channels
+    RunningRMS.rms()            - returns the RMS value as windows x channels
+    """
+
+    def __init__(self, windows, nchans):
+        self.windows = np.maximum(np.asarray(windows, dtype=int), 1)
+        self.length  = int(max(self.windows))
+        self.squares = np.zeros((self.length, nchans))          # circular buffer with the squared samples
+        self.sumsq   = np.zeros((len(self.windows), nchans))    # sum of squares in each window
+        self.count   = 0                                        # total number of samples
+        self.stale   = 0                                        # number of samples since the sums were recomputed
+
+    def update(self, dat):
+        sq = np.square(dat)
+        n = sq.shape[0]
+        if n >= self.length:
+            # all samples in the buffer are replaced by the new ones
+            self.squares[:] = sq[-self.length:]
+            self.count = self.length
+            self.recompute()
+            return
+
+        total = np.sum(sq, axis=0)
+        for i, window in enumerate(self.windows):
+            # these are the samples that drop out of the window, negative ones were never added
+            leave = np.arange(self.count - window, self.count + n - window)
+            old = leave[np.logical_and(leave >= 0, leave < self.count)]
+            new = leave[leave >= self.count] - self.count
+            self.sumsq[i] += total - np.sum(self.squares[old % self.length], axis=0) - np.sum(sq[new], axis=0)
+
+        self.squares[(self.count + np.arange(n)) % self.length] = sq
+        self.count += n
+        self.stale += n
+        if self.stale >= self.length:
+            # prevent rounding errors from accumulating
+            self.recompute()
+
+    def recompute(self):
+        for i, window in enumerate(self.windows):
+            sel = np.arange(max(self.count - window, 0), self.count)
+            self.sumsq[i] = np.sum(self.squares[sel % self.length], axis=0)
+        self.stale = 0
+
+    def rms(self):
+        count = np.maximum(np.minimum(self.windows, self.count), 1)
+        return np.sqrt(np.maximum(self.sumsq, 0) / count[:, np.newaxis])
+
+
 def _setup():
     '''Initialize the module
     This adds a set of global variables
@@ -99,7 +151,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input, name
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, begsample, endsample
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, windows, window, running, begsample, endsample
 
     # this is the timeout for the FieldTrip buffer
     timeout = patch.getfloat('fieldtrip', 'timeout', default=30)
@@ -126,8 +178,12 @@ def _start():
         chanindx.append(patch.getint('input', item[0]) - 1)  # the channel number
 
     prefix = patch.getstring('output', 'prefix')
-    window = patch.getfloat('processing', 'window')     # in seconds
-    window = int(window * hdr_input.fSample)            # in samples
+    windows = patch.getfloat('processing', 'window', multiple=True)     # in seconds
+    windows = [max(int(w * hdr_input.fSample), 1) for w in windows]     # in samples, at least one
+    window = max(windows)                                               # the longest window
+
+    # this keeps the running sum of squares for each window, only the new samples are added on every iteration
+    running = RunningRMS(windows, len(chanindx))
 
     begsample = -1
     endsample = -1
@@ -142,37 +198,40 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, debug, ft_host, ft_port, ft_input
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, window, begsample, endsample
-    global dat, rms, i, chanvec, chanval, name, val, key
-
-    hdr_input = ft_input.getHeader()
-    if (hdr_input.nSamples - 1) < endsample:
-        raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
-        # there are not yet enough samples in the buffer
-        monitor.info('Waiting for data to arrive...')
-        return
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, windows, window, running, begsample, endsample
+    global dat, rms, i, name, val, key, values
 
-    # get the most recent data segment
-    begsample = hdr_input.nSamples - window
+    # wait for new data, or until there is enough data for the first window
+    # this also detects a buffer reset, a stalled data stream is not an error
+    while True:
+        hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(max(endsample + 1, window - 1), timeout, endsample + 1, error=False)
+        if hdr_input.nSamples > max(endsample + 1, window - 1):
+            break
+        monitor.info("Waiting for data...")
+
+    # only get the samples that are new since the previous iteration
+    begsample = max(endsample + 1, hdr_input.nSamples - window)
     endsample = hdr_input.nSamples - 1
     dat = ft_input.getData([begsample, endsample]).astype(np.double)
     dat = dat[:, chanindx]
 
-    rms = [0.] * len(chanindx)
-    for i, chanvec in enumerate(dat.transpose()):
-        for chanval in chanvec:
-            rms[i] += chanval * chanval
-        if rms[i]>0:
-            # this avoids an occasional "ValueError: math domain error"
-            rms[i] = math.sqrt(rms[i] / window)
-
-    monitor.update("rms", rms)
-
-    for name, val in zip(channame, rms):
-        # send it as control value: prefix.channelX=val
-        key = "%s.%s" % (prefix, name)
-        patch.setvalue(key, val)
+    running.update(dat)
+    rms = running.rms()
+
+    monitor.update("rms", rms.tolist())
+
+    # write all values to Redis in a single round trip
+    values = []
+    for i in range(len(windows)):
+        for name, val in zip(channame, rms[i]):
+            if len(windows) == 1:
+                # send it as control value: prefix.channelX=val
+                key = "%s.%s" % (prefix, name)
+            else:
+                # send it as control value: prefix.channelX.200ms=val
+                key = "%s.%s.%dms" % (prefix, name, round(1000. * windows[i] / hdr_input.fSample))
+            values.append((key, val))
+    patch.setvalues(values)
 
     # there should not be any local variables in this function, they should all be global
     if len(locals()):
@@ -27,6 +27,7 @@ import redis
 import sys
 import time
 from scipy.signal import detrend
+from scipy.signal.windows import dpss
 
 if hasattr(sys, 'frozen'):
     path = os.path.split(sys.executable)[0]
@@ -92,7 +93,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, ft_host, ft_port, ft_input, name
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, begsample, endsample
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, begsample, endsample, ft_window, bandspec, segspec, segcache
 
     # this is the timeout for the FieldTrip buffer
     timeout = patch.getfloat('fieldtrip', 'timeout', default=30)
@@ -122,6 +123,16 @@ def _start():
 
     prefix = patch.getstring('output', 'prefix')
 
+    # this keeps the most recent samples, the window length is updated in the loop
+    ft_window = FieldTrip.SlidingWindow(ft_input, 0)
+
+    # the taper and the band weights are only recomputed when the window or the bands change
+    bandspec = None
+
+    # the power spectra of the segments are reused in the next iteration, the key is the first sample
+    segspec = None
+    segcache = {}
+
     begsample = -1
     endsample = -1
 
@@ -131,8 +142,8 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, monitor, ft_host, ft_port, ft_input
-    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, begsample, endsample
-    global scale_window, offset_window, window, taper, frequency, band_items, bandname, bandlo, bandhi, lohi, dat, power, chan, band, meandat, sample, F, i, lo, hi, count, key
+    global timeout, hdr_input, start, channel_items, channame, chanindx, item, prefix, begsample, endsample, ft_window, bandspec, segspec, segcache
+    global scale_window, offset_window, window, method, segment, overlap, bandwidth, segstep, segbeg, spectrum, taper, frequency, weight, band_items, bandname, bandlo, bandhi, lohi, lo, hi, dat, power, chan, band, F, i, key, values
 
     scale_window = patch.getfloat('scale', 'window', default=1.)
     offset_window = patch.getfloat('offset', 'window', default=0.)
@@ -141,9 +152,20 @@ def _loop_once():
 
     monitor.update('window', window)
 
-    window = int(round(window * hdr_input.fSample))  # in samples
-    taper = np.hanning(window)
-    frequency = np.fft.rfftfreq(window, 1.0 / hdr_input.fSample)
+    # the window and the segments should span at least two samples to compute a spectrum
+    window = max(int(round(window * hdr_input.fSample)), 2)  # in samples
+
+    # the window can be split in overlapping segments, these are averaged
+    method    = patch.getstring('processing', 'method', default='fft')
+    segment   = patch.getfloat('processing', 'segment', default=0.5)    # in seconds
+    overlap   = patch.getfloat('processing', 'overlap', default=0.5)    # as fraction
+    bandwidth = patch.getfloat('processing', 'bandwidth', default=3)    # for multitaper
+
+    if method == 'fft':
+        segment = window
+    else:
+        segment = min(max(int(round(segment * hdr_input.fSample)), 2), window)  # in samples
+    segstep = max(int(round(segment * (1. - overlap))), 1)              # in samples
 
     band_items = config.items('band')
     bandname = []
@@ -158,51 +180,88 @@ def _loop_once():
 
     monitor.debug(bandname, bandlo, bandhi)
 
-    hdr_input = ft_input.getHeader()
-    if (hdr_input.nSamples - 1) < endsample:
-        raise RuntimeError("buffer reset detected")
-    if hdr_input.nSamples < window:
-        # there are not yet enough samples in the buffer
+    if segspec != (method, segment, segstep, bandwidth):
+        segspec = (method, segment, segstep, bandwidth)
+        segcache = {}
+        if method == 'multitaper':
+            if bandwidth >= segment / 2.:
+                raise RuntimeError("the segment of %d samples is too short for a bandwidth of %g" % (segment, bandwidth))
+            # the DPSS tapers are in rows
+            taper = dpss(segment, bandwidth, Kmax=min(max(int(2 * bandwidth) - 1, 1), segment - 1), sym=False)
+            taper = np.atleast_2d(taper)
+        elif method in ['fft', 'welch']:
+            taper = np.hanning(segment)[np.newaxis, :]
+        else:
+            raise RuntimeError("unsupported method '%s'" % (method))
+
+    if bandspec != (segment, bandlo, bandhi):
+        bandspec = (segment, bandlo, bandhi)
+        frequency = np.fft.rfftfreq(segment, 1.0 / hdr_input.fSample)
+        # each column of the weight matrix averages the frequency bins in one band
+        weight = np.zeros((len(frequency), len(bandname)))
+        for band, (lo, hi) in enumerate(zip(bandlo, bandhi)):
+            weight[:, band] = np.logical_and(frequency>=lo, frequency<=hi)
+        weight /= np.maximum(weight.sum(axis=0), 1)
+        monitor.debug('recomputed the taper and the band weights')
+
+    # wait for new data, or until there is enough data for the first window
+    # this also detects a buffer reset, a stalled data stream is not an error
+    while True:
+        hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(max(endsample + 1, window - 1), timeout, endsample + 1, error=False)
+        if hdr_input.nSamples > max(endsample + 1, window - 1):
+            break
         monitor.info("Waiting for data...")
-        return
 
     # get the most recent data segment
     begsample = hdr_input.nSamples - window
     endsample = hdr_input.nSamples - 1
-    dat = ft_input.getData([begsample, endsample]).astype(np.double)
+    ft_window.resize(window)
+    dat = ft_window.update(hdr_input)
     dat = dat[:, chanindx]
 
-    # demean the data to prevent spectral leakage
-    dat = detrend(dat, axis=0, type='constant')
+    # the segments are aligned to the sample number, so that they can be reused in the next iteration
+    segbeg = np.arange(begsample + (-begsample) % segstep, endsample - segment + 2, segstep)
+    if len(segbeg) == 0 or method == 'fft':
+        segbeg = [begsample]
+        segcache = {}
 
-    # taper the data
-    dat = dat * taper[:, np.newaxis]
+    for sample in list(segcache.keys()):
+        if sample < begsample:
+            del segcache[sample]
 
-    # compute the FFT over the sample direction
-    F = np.fft.rfft(dat, axis=0)
+    for sample in segbeg:
+        if sample in segcache:
+            continue
+        segdat = dat[sample - begsample:sample - begsample + segment, :]
 
-    power = [0] * len(channame) * len(bandname)
-    i = 0
-    for chan in range(F.shape[1]):
-        for lo,hi in zip(bandlo,bandhi):
-            power[i] = 0
-            count = 0
-            for sample in range(len(frequency)):
-                if frequency[sample]>=lo and frequency[sample]<=hi:
-                    power[i] += abs(F[sample, chan]*F[sample, chan])
-                    count    += 1
-            if count>0:
-                power[i] /= count
-            i+=1
+        # demean the data to prevent spectral leakage
+        segdat = detrend(segdat, axis=0, type='constant')
+
+        # taper the data, this results in tapers x samples x channels
+        segdat = taper[:, :, np.newaxis] * segdat[np.newaxis, :, :]
+
+        # compute the FFT over the sample direction and average the power over tapers
+        F = np.fft.rfft(segdat, axis=1)
+        segcache[sample] = np.mean(F.real**2 + F.imag**2, axis=0)
+
+    # average the power spectra over segments, this results in frequencies x channels
+    spectrum = np.mean([segcache[sample] for sample in segbeg], axis=0)
+
+    # compute the average power in each band, this results in channels x bands
+    power = np.dot(spectrum.T, weight)
+    power = power.flatten().tolist()
 
     monitor.debug(power)
 
+    # write all values to Redis in a single round trip
+    values = []
     i = 0
     for chan in channame:
         for band in bandname:
             key = "%s.%s.%s" % (prefix, chan, band)
-            patch.setvalue(key, power[i])
+            values.append((key, power[i]))
             i+=1
+    patch.setvalues(values)
 
 
 def _loop_forever():
@@ -23,6 +23,7 @@ import configparser
 import argparse
 import math
 import multiprocessing
+import numpy as np
 import os
 import pyaudio
 import redis
@@ -52,28 +53,24 @@ sys.path.insert(0, os.path.join(path, '../../lib'))
 import EEGsynth
 
 
-class TriggerThread(threading.Thread):
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self.running = True
+class Trigger():
+    def __init__(self, redischannel, indx):
+        self.redischannel = redischannel
+        self.indx = indx
+    def __call__(self, item):
+        monitor.trace(item)
+        # each trigger can have its own pitch, otherwise they share the same pitch
+        vco_pitch = patch.getfloat('control', 'vco_pitch', multiple=True, default=60)
+        vco_pitch = vco_pitch[self.indx] if len(vco_pitch) > self.indx else vco_pitch[0]
+        scale_vco_pitch = patch.getfloat('scale', 'vco_pitch', default=1)
+        offset_vco_pitch = patch.getfloat('offset', 'vco_pitch', default=0)
+        # map the Redis values to MIDI note values
+        vco_pitch = EEGsynth.rescale(vco_pitch, scale_vco_pitch, offset_vco_pitch)
         with lock:
-            self.time = 0
-            self.last = 0
-
-    def stop(self):
-        self.running = False
-
-    def run(self):
-        pubsub = r.pubsub()
-        pubsub.subscribe('SYNTHESIZER_UNBLOCK')  # this message unblocks the redis listen command
-        pubsub.subscribe(patch.getstring('control', 'adsr_gate'))
-        while self.running:
-            for item in pubsub.listen():
-                if not self.running or not item['type'] == 'message':
-                    break
-                monitor.trace(item)
-                with lock:
-                    self.last = self.time
+            # the duration of the envelope is needed to know when the voice is available again
+            duration = control.adsr_attack + control.adsr_decay + control.adsr_sustain + control.adsr_release
+            voice = renderer.trigger(vco_pitch, duration)
+        monitor.debug('voice %d plays note %g' % (voice, vco_pitch))
 
 
 class ControlThread(threading.Thread):
@@ -102,23 +99,23 @@ class ControlThread(threading.Thread):
             ################################################################################
             # these are to map the Redis values to MIDI values
             ################################################################################
-            scale_vco_pitch = patch.getfloat('scale', 'vco_pitch', default=1)
-            offset_vco_pitch = patch.getfloat('offset', 'vco_pitch', default=0)
             scale_lfo_frequency = patch.getfloat('scale', 'lfo_frequency', default=10)
             offset_lfo_frequency = patch.getfloat('offset', 'lfo_frequency', default=0)
 
             ################################################################################
             # VCO
             ################################################################################
-            vco_pitch = patch.getfloat('control', 'vco_pitch', default=60)
+            # with multiple voices the pitch is determined for each voice when it is triggered
+            # with a single voice it follows the pitch, also while the note is playing
+            scale_vco_pitch = patch.getfloat('scale', 'vco_pitch', default=1)
+            offset_vco_pitch = patch.getfloat('offset', 'vco_pitch', default=0)
+            vco_pitch = patch.getfloat('control', 'vco_pitch', multiple=True, default=60)[0]
+            vco_pitch = EEGsynth.rescale(vco_pitch, scale_vco_pitch, offset_vco_pitch)
             vco_sin = patch.getfloat('control', 'vco_sin', default=0.75)
             vco_tri = patch.getfloat('control', 'vco_tri', default=0.00)
             vco_saw = patch.getfloat('control', 'vco_saw', default=0.25)
             vco_sqr = patch.getfloat('control', 'vco_sqr', default=0.00)
 
-            # map the Redis values to MIDI note values
-            vco_pitch = EEGsynth.rescale(vco_pitch, scale_vco_pitch, offset_vco_pitch)
-
             vco_total = vco_sin + vco_tri + vco_saw + vco_sqr
             if vco_total > 0:
                 # these are all scaled relatively to each other
@@ -185,6 +182,72 @@ class ControlThread(threading.Thread):
             monitor.update('adsr_release ', adsr_release)
             monitor.update('vca_envelope ', vca_envelope)
 
+class Renderer():
+    def __init__(self, rate, voices=1):
+        self.rate = float(rate)
+        # the sample number at which the next block starts
+        self.time = 0
+        # the pitch, the sample at which it was triggered and the sample at which its envelope ends are kept for each voice
+        self.pitch = np.zeros(voices)
+        self.last = np.full(voices, -np.inf)
+        self.end = np.full(voices, -np.inf)
+        # the phase is expressed in cycles and continues over blocks
+        self.vco_phase = np.zeros(voices)
+        self.lfo_phase = 0.
+
+    def trigger(self, pitch, duration):
+        # start a voice at the next block, this uses a voice that has finished playing
+        # or otherwise steals the one that was triggered the longest time ago
+        finished = self.end <= self.time
+        if np.any(finished):
+            voice = np.flatnonzero(finished)[0]
+        else:
+            voice = np.argmin(self.last)
+        self.pitch[voice] = pitch
+        self.last[voice] = self.time
+        # the voice remains taken until the next block, also with an envelope of zero duration
+        self.end[voice] = self.time + max(duration, 1)
+        return voice
+
+    def render(self, t, vco_sin, vco_tri, vco_saw, vco_sqr, lfo_depth, lfo_frequency, adsr_attack, adsr_decay, adsr_sustain, adsr_release, vca_envelope):
+        # compute all samples of all voices at once, t contains the sample numbers of the block
+        # the control values are constant over the block, the output is between -1 and 1
+        step = np.arange(1, len(t) + 1) / self.rate
+
+        # compose the VCO waveform, this has one row per voice
+        # note 60 on the keyboard is the C4, which is 261.63 Hz
+        # note 72 on the keyboard is the C5, which is 523.25 Hz
+        frequency = np.power(2, (self.pitch - 60) / 12) * 261.63
+        phase = self.vco_phase[:, np.newaxis] + frequency[:, np.newaxis] * step
+        self.vco_phase = phase[:, -1] % 1
+        phase = phase % 1
+        waveform = vco_sin * np.sin(2 * np.pi * phase)
+        waveform += vco_tri * (1 - 4 * np.abs(phase - 0.5))
+        waveform += vco_saw * (2 * phase - 1)
+        waveform += vco_sqr * np.where(phase > 0.5, 1., -1.)
+        waveform[self.pitch <= 0] = 0
+
+        # compose and apply the ADSR, the envelope is piecewise linear from the trigger onwards
+        knots = np.cumsum([0, adsr_attack, adsr_decay, adsr_sustain, adsr_release])
+        adsr_envelope = np.interp(t - self.last[:, np.newaxis], knots, [0, 1, 0.5, 0.5, 0], left=0, right=0)
+
+        # mix the voices, a single voice has the same loudness regardless of the polyphony
+        waveform = np.sum(waveform * adsr_envelope, axis=0)
+
+        # compose and apply the LFO
+        phase = self.lfo_phase + lfo_frequency * step
+        self.lfo_phase = phase[-1] % 1
+        lfo_envelope = (np.sin(2 * np.pi * phase) + 1) / 2
+        lfo_envelope = lfo_depth + (1 - lfo_depth) * lfo_envelope
+        waveform *= lfo_envelope
+
+        # apply the VCA
+        waveform *= vca_envelope
+
+        # multiple voices together can exceed the range
+        return np.clip(waveform, -1, 1)
+
+
 def _setup():
     '''Initialize the module
     This adds a set of global variables
@@ -217,7 +280,7 @@ def _start():
     This uses the global variables from setup and adds a set of global variables
     '''
     global parser, args, config, r, response, patch, name
-    global monitor, debug, p, device, rate, blocksize, nchans, format, info, stream, lock, control, trigger, devinfo, block, offset, autoscale
+    global monitor, debug, p, device, rate, blocksize, nchans, format, info, stream, lock, control, trigger, devinfo, block, offset, autoscale, datatype, renderer, polyphony, dispatcher, indx, redischannel
 
     # this can be used to show parameters that have changed
     monitor = EEGsynth.monitor(name=name, debug=patch.getint('general', 'debug'))
@@ -231,7 +294,13 @@ def _start():
     rate = patch.getint('audio', 'rate')
     blocksize = patch.getint('audio', 'blocksize')
     nchans = 1
-    format = p.get_format_from_width(2)  # the desired sample width in bytes (1, 2, 3, or 4)
+    datatype = patch.getstring('audio', 'format', default='int16')
+    if datatype == 'int16':
+        format = pyaudio.paInt16
+    elif datatype == 'float32':
+        format = pyaudio.paFloat32
+    else:
+        raise NotImplementedError('unsupported audio format')
 
     monitor.info('------------------------------------------------------------------')
     info = p.get_host_api_info_by_index(0)
@@ -262,9 +331,18 @@ def _start():
     control = ControlThread()
     control.start()
 
-    # start the background thread that deals with triggers
-    trigger = TriggerThread()
-    trigger.start()
+    # this computes the audio signal of all voices for a whole block at once
+    polyphony = patch.getint('audio', 'polyphony', default=1)
+    renderer = Renderer(rate, polyphony)
+
+    # create the background thread that deals with triggers, each trigger starts a voice
+    trigger = []
+    dispatcher = EEGsynth.dispatcher(r)
+    for indx, redischannel in enumerate(patch.getstring('control', 'adsr_gate', multiple=True)):
+        trigger.append(Trigger(redischannel, indx))
+        dispatcher.register(redischannel, trigger[-1])
+        monitor.info("trigger configured for " + redischannel)
+    dispatcher.start()
 
     block = 0
     offset = 0
@@ -279,70 +357,41 @@ def _loop_once():
     This uses the global variables from setup and start, and adds a set of global variables
     '''
     global parser, args, config, r, response, patch
-    global monitor, debug, p, device, rate, blocksize, nchans, format, info, stream, lock, control, trigger, devinfo, block, offset, autoscale
-    global BUFFER, t, last, vco_pitch, vco_sin, vco_tri, vco_saw, vco_sqr, lfo_depth, lfo_frequency, adsr_attack, adsr_decay, adsr_sustain, adsr_release, vca_envelope, frequency, period, wave_sin, wave_tri, wave_saw, wave_sqr, waveform, lfo_envelope, adsr_envelope
+    global monitor, debug, p, device, rate, blocksize, nchans, format, info, stream, lock, control, trigger, devinfo, block, offset, autoscale, datatype, renderer, polyphony, dispatcher
+    global BUFFER, t, vco_sin, vco_tri, vco_saw, vco_sqr, lfo_depth, lfo_frequency, adsr_attack, adsr_decay, adsr_sustain, adsr_release, vca_envelope, waveform
 
     ################################################################################
     # this is constantly generating the output signal
     ################################################################################
-    BUFFER = ''
-
-    for t in range(offset, offset + blocksize):
-        # update the time for the trigger detection
-
-        with lock:
-            trigger.time = t
-            last = trigger.last
-            vco_pitch = control.vco_pitch
-            vco_sin = control.vco_sin
-            vco_tri = control.vco_tri
-            vco_saw = control.vco_saw
-            vco_sqr = control.vco_sqr
-            lfo_depth = control.lfo_depth
-            lfo_frequency = control.lfo_frequency
-            adsr_attack = control.adsr_attack
-            adsr_decay = control.adsr_decay
-            adsr_sustain = control.adsr_sustain
-            adsr_release = control.adsr_release
-            vca_envelope = control.vca_envelope
-
-        # compose the VCO waveform
-        if vco_pitch > 0:
-            # note 60 on the keyboard is the C4, which is 261.63 Hz
-            # note 72 on the keyboard is the C5, which is 523.25 Hz
-            frequency = math.pow(2, (vco_pitch / 12 - 4)) * 261.63
-            period = rate / frequency
-            wave_sin = vco_sin * (math.sin(math.pi * frequency * t / rate) + 1) / 2
-            wave_tri = vco_tri * float(abs(t % period - period / 2)) / period * 2
-            wave_saw = vco_saw * float(t % period) / period
-            wave_sqr = vco_sqr * float((t % period) > period / 2)
-            waveform = (wave_sin + wave_tri + wave_saw + wave_sqr) * 127
-        else:
-            waveform = 0
-
-        # compose and apply the LFO
-        lfo_envelope = (math.sin(math.pi * lfo_frequency * t / rate) + 1) / 2
-        lfo_envelope = lfo_depth + (1 - lfo_depth) * lfo_envelope
-        waveform = lfo_envelope * waveform
-
-        # compose and apply the ADSR
-        if adsr_attack > 0 and (t - last) < adsr_attack:
-            adsr_envelope = (t - last) / adsr_attack
-        elif adsr_decay > 0 and (t - last - adsr_attack) < adsr_decay:
-            adsr_envelope = 1.0 - 0.5 * (t - last - adsr_attack) / adsr_decay
-        elif adsr_sustain > 0 and (t - last - adsr_attack - adsr_decay) < adsr_sustain:
-            adsr_envelope = 0.5
-        elif adsr_release > 0 and (t - last - adsr_attack - adsr_decay - adsr_sustain) < adsr_release:
-            adsr_envelope = 0.5 - 0.5 * (t - last - adsr_attack - adsr_decay - adsr_sustain) / adsr_release
-        else:
-            adsr_envelope = 0
-        waveform = adsr_envelope * waveform
-
-        # apply the VCA
-        waveform = vca_envelope * waveform
-
-        # add the current waveform sample to the buffer
-        BUFFER = BUFFER + chr(int(waveform))
+    t = np.arange(offset, offset + blocksize)
+
+    # the control values are captured once per block
+    with lock:
+        # triggers that arrive from now on start at the next block
+        renderer.time = offset + blocksize
+        if polyphony == 1:
+            # a single voice follows the pitch, also while the note is playing
+            renderer.pitch[0] = control.vco_pitch
+        vco_sin = control.vco_sin
+        vco_tri = control.vco_tri
+        vco_saw = control.vco_saw
+        vco_sqr = control.vco_sqr
+        lfo_depth = control.lfo_depth
+        lfo_frequency = control.lfo_frequency
+        adsr_attack = control.adsr_attack
+        adsr_decay = control.adsr_decay
+        adsr_sustain = control.adsr_sustain
+        adsr_release = control.adsr_release
+        vca_envelope = control.vca_envelope
+
+        # the voices cannot be triggered while the block is being computed
+        waveform = renderer.render(t, vco_sin, vco_tri, vco_saw, vco_sqr, lfo_depth, lfo_frequency, adsr_attack, adsr_decay, adsr_sustain, adsr_release, vca_envelope)
+
+    # convert the waveform to the sample format of the audio device
+    if datatype == 'int16':
+        BUFFER = (waveform * 32767).astype(np.int16).tobytes()
+    else:
+        BUFFER = waveform.astype(np.float32).tobytes()
 
     # write the buffer content to the audio device
     stream.write(BUFFER)
@@ -365,13 +414,11 @@ def _loop_forever():
 def _stop(*args):
     '''Stop and clean up on SystemExit, KeyboardInterrupt
     '''
-    global monitor, control, trigger, r, stream, p
+    global monitor, control, dispatcher, stream, p
     monitor.success('Closing threads')
     control.stop()
-    trigger.stop()
-    r.publish('SYNTHESIZER_UNBLOCK', 1)
+    dispatcher.stop()
     control.join()
-    trigger.join()
     stream.stop_stream()
     stream.close()
     p.terminate()
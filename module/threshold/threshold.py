@@ -154,17 +154,8 @@ def _loop_once():
     global timeout, hdr_input, start, rectify, invert, prefix, window, scale_threshold, offset_threshold, scale_interval, offset_interval, channels, previous, begsample, endsample
     global dat_input, threshold, interval, channel, maxind, maxval, sample, key
 
-    # determine when we start polling for available data
-    start = time.time()
-
-    while endsample>hdr_input.nSamples-1:
-        # wait until there is enough data
-        time.sleep(patch.getfloat('general', 'delay'))
-        hdr_input = ft_input.getHeader()
-        if (hdr_input.nSamples-1)<(endsample-window):
-            raise RuntimeError("buffer reset detected")
-        if (time.time()-start)>timeout:
-            raise RuntimeError("timeout while waiting for data")
+    # wait until there is enough data
+    hdr_input.nSamples, hdr_input.nEvents = ft_input.waitForSamples(endsample, timeout, begsample)
 
     # get the input data
     dat_input = ft_input.getData([begsample, endsample]).astype(np.double)